@@ -1,8 +1,35 @@
-from flask import Flask, request, jsonify
-from main import run_agent  # Import the run_agent function from the module
+from flask import Flask, Response, request, jsonify, url_for, stream_with_context
+from main import run_agent, run_batch, stream_agent, get_result_store, warmup  # Import the agent functions from the module
+from jobs import JobManager
+from result_store import FRESHNESS, ResearchResultStore
+import metrics
+import json
+import os
+import time
 import yaml
 app = Flask(__name__)
 
+# Set WARMUP_ON_START=1 to load models and clients before serving, instead of on the first request
+if os.getenv("WARMUP_ON_START", "").lower() in ("1", "true", "yes"):
+    warmup()
+
+# Research jobs run on a bounded worker pool instead of inside the request
+jobs = JobManager(run_agent)
+
+# A conditional /agent request whose stored results are younger than this is answered without rerunning
+RESULTS_MAX_AGE = float(os.getenv("RESULTS_MAX_AGE", str(min(FRESHNESS.values()))))
+
+def parse_flag(value: str) -> bool:
+    return value.lower() in ("1", "true", "yes")
+
+
+def json_response(body: bytes, etag: str):
+    """Returns pre-serialized JSON with an ETag, answering 304 when the client's copy matches."""
+    response = app.response_class(body, mimetype="application/json")
+    response.set_etag(etag)
+    return response.make_conditional(request)
+
+
 # Route to call the agent with the company name
 @app.route('/agent', methods=['GET'])
 def agent():
@@ -12,18 +39,123 @@ def agent():
         return jsonify({"error": "Company name is required"}), 400
     
     try:
+        refresh = request.args.get('refresh', default=False, type=parse_flag)
+
+        # The client already has the latest stored results and they are still fresh: 304 without any work
+        if request.if_none_match and not refresh:
+            stored = get_result_store().latest(company_name)
+            if (stored and stored["etag"] in request.if_none_match
+                    and time.time() - stored["created_at"] < RESULTS_MAX_AGE):
+                return json_response(stored["body"], stored["etag"])
+
         # Call the agent function with the company name
-        research_results = run_agent(company_name)
+        with metrics.trace() as spans:
+            research_results = run_agent(company_name, refresh=refresh)
         
         # If results contain an error, return it
         if "error" in research_results:
             return jsonify(research_results), 500
         
-        # Return the research results as YAML (could also return as JSON)
-        return yaml.dump(research_results, default_flow_style=False, allow_unicode=True)
+        # The ETag covers the results only, so it matches the stored copy whatever else is added
+        body, etag = ResearchResultStore.serialize(research_results)
+
+        # Include the per-stage timings of this request with ?trace=true
+        if request.args.get('trace', default=False, type=parse_flag):
+            research_results = {**research_results, "trace": spans}
+            body, _ = ResearchResultStore.serialize(research_results)
+
+        # Return the research results as JSON, or as YAML with ?format=yaml
+        if request.args.get('format') == 'yaml':
+            return yaml.safe_dump(research_results, default_flow_style=False, allow_unicode=True)
+        return json_response(body, etag)
     
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+# Route to read the latest stored results for a company without running the agent
+@app.route('/agent/results', methods=['GET'])
+def agent_results():
+    company_name = request.args.get('company', type=str)
+
+    if not company_name:
+        return jsonify({"error": "Company name is required"}), 400
+
+    stored = get_result_store().latest(company_name)
+    if stored is None:
+        return jsonify({"error": "No results stored for this company"}), 404
+    return json_response(stored["body"], stored["etag"])
+
+
+# Route to stream each domain's results as soon as its node finishes.
+# Sends server-sent events by default, or newline-delimited JSON with ?format=ndjson
+@app.route('/agent/stream', methods=['GET'])
+def agent_stream():
+    company_name = request.args.get('company', type=str)
+
+    if not company_name:
+        return jsonify({"error": "Company name is required"}), 400
+
+    ndjson = request.args.get('format') == 'ndjson'
+    refresh = request.args.get('refresh', default=False, type=parse_flag)
+
+    def generate():
+        for event in stream_agent(company_name, refresh=refresh):
+            payload = json.dumps(event, default=str)
+            if ndjson:
+                yield payload + "\n"
+            else:
+                yield f"event: {event['event']}\ndata: {payload}\n\n"
+
+    mimetype = "application/x-ndjson" if ndjson else "text/event-stream"
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}  # Stop proxies from buffering the stream
+    return Response(stream_with_context(generate()), mimetype=mimetype, headers=headers)
+
+
+# Route to research a list of companies; streams one JSON line per company as each finishes
+@app.route('/agent/batch', methods=['POST'])
+def agent_batch():
+    payload = request.get_json(silent=True) or {}
+    company_names = payload.get('companies')
+
+    if not company_names or not isinstance(company_names, list):
+        return jsonify({"error": "A list of company names is required"}), 400
+
+    def generate():
+        for name, research_results in run_batch(str(name) for name in company_names):
+            yield json.dumps({"company_name": name, **research_results}, default=str) + "\n"
+
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+
+# Route to start a research job; returns immediately with the job id
+@app.route('/agent/jobs', methods=['POST'])
+def create_job():
+    payload = request.get_json(silent=True) or {}
+    company_name = payload.get('company') or request.args.get('company', type=str)
+
+    if not company_name:
+        return jsonify({"error": "Company name is required"}), 400
+
+    job = jobs.submit(company_name)
+    response = job.to_dict(include_result=False)
+    response["status_url"] = url_for('get_job', job_id=job.id)
+    return jsonify(response), 202, {"Location": response["status_url"]}
+
+
+# Route to poll a research job's status, including the results once it is done
+@app.route('/agent/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job.to_dict())
+
+
+# Route exposing pipeline latency histograms and counters in the Prometheus text format
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    return app.response_class(metrics.render_prometheus(), mimetype="text/plain; version=0.0.4")
+
+
 if __name__ == "__main__":
     app.run(debug=True)
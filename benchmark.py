@@ -0,0 +1,333 @@
+# Offline benchmark for the research pipeline. Runs graph.invoke against local fakes (fakes.py):
+# a Tavily stub, a local HTTP server serving generated or recorded HTML/PDF pages, a deterministic
+# LLM with configurable latency and, unless --real-embeddings is given, hashing embeddings.
+#
+#   python benchmark.py --companies 8 --concurrency 1,4,8 --llm-latency 0.5 --page-latency 0.05
+#   python benchmark.py --startup     # cold import and warmup times of a fresh process
+#   python benchmark.py --rss         # also the peak RSS of each request, each in a fresh process
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+try:
+    import resource  # Not available on Windows
+except ImportError:
+    resource = None
+
+
+def configure_environment(workdir: str, args):
+    """Points every backend at the local fakes and every store at a scratch directory.
+
+    Must run before utils or graph are imported, since they read their settings at import time.
+    Subprocesses started afterwards (see measure_startup) inherit the same settings.
+    """
+    os.environ["SEARCH_BACKEND"] = "stub"
+    os.environ["LLM_BACKEND"] = "fake"
+    os.environ["FAKE_LLM_LATENCY"] = str(args.llm_latency)
+    os.environ["EMBEDDING_BACKEND"] = "fastembed" if args.real_embeddings else "fake"
+    os.environ["RESULT_STORE_PATH"] = os.path.join(workdir, "research.db")
+    os.environ["ENRICH_COMPETITORS"] = "0"  # Background competitor research would skew the timings
+    os.environ["TAVILY_RPS"] = str(args.tavily_rps)  # Quotas are off (0) unless asked for
+    os.environ["GROQ_RPM"] = str(args.groq_rpm)
+    os.environ["GROQ_TPM"] = str(args.groq_tpm)
+    os.environ["EXTRACTION_MODE"] = args.extraction_mode
+    for name in ("SEARCH_CACHE_STORE", "LLM_CACHE_STORE"):
+        os.environ[name] = "memory"
+    for name in ("FETCH_CACHE_DIR", "EMBEDDING_CACHE_DIR"):
+        os.environ.pop(name, None)
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, round(pct / 100 * (len(values) - 1))))
+    return values[index]
+
+
+def peak_rss_mb() -> float:
+    if resource is None:
+        return 0.0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024  # bytes on macOS, KB elsewhere
+
+
+def reset_peak_rss() -> bool:
+    """Resets the process's peak RSS (Linux 4.0+), so it covers only what runs next."""
+    try:
+        with open("/proc/self/clear_refs", "w") as outfile:
+            outfile.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def request_peak_rss_mb() -> float:
+    """Peak RSS since reset_peak_rss (VmHWM), or since the process started where that isn't available."""
+    try:
+        with open("/proc/self/status") as infile:
+            for line in infile:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return peak_rss_mb()
+
+
+def current_rss_mb() -> float:
+    """Resident memory right now (Linux only; elsewhere falls back to the peak so far)."""
+    try:
+        with open("/proc/self/statm") as infile:
+            return int(infile.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, AttributeError):
+        return peak_rss_mb()
+
+
+def run_level(graph_module, metrics_module, companies: List[str], concurrency: int, trace_memory: bool) -> dict:
+    """Researches the companies with `concurrency` graphs in flight and collects timings."""
+    def run_one(name: str):
+        start = time.perf_counter()
+        with metrics_module.trace() as spans:
+            graph_module.get_graph().invoke(graph_module.AgentState(company_name=name), config=graph_module.invoke_config())
+        return time.perf_counter() - start, spans
+
+    if trace_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        runs = list(pool.map(run_one, companies))
+    wall = time.perf_counter() - start
+    heap_peak = 0.0
+    if trace_memory:
+        heap_peak = tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+        tracemalloc.stop()
+
+    latencies = [latency for latency, _ in runs]
+    nodes: Dict[str, List[float]] = {}
+    stages: Dict[str, List[float]] = {}
+    for _, spans in runs:
+        for span in spans:
+            if "node" in span:
+                nodes.setdefault(span["node"], []).append(span["seconds"])
+            else:
+                stages.setdefault(span["stage"], []).append(span["seconds"])
+
+    summarize = lambda values: {
+        "count": len(values),
+        "p50": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "total": sum(values),
+    }
+    return {
+        "concurrency": concurrency,
+        "companies": len(companies),
+        "wall_seconds": wall,
+        "companies_per_hour": len(companies) / wall * 3600 if wall else 0.0,
+        "latency": {**summarize(latencies), "mean": statistics.fmean(latencies) if latencies else 0.0},
+        "nodes": {name: summarize(values) for name, values in sorted(nodes.items())},
+        "stages": {name: summarize(values) for name, values in sorted(stages.items())},
+        "heap_peak_mb": heap_peak,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+# Run in a fresh interpreter per sample, so nothing is already imported or cached
+STARTUP_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+imported = time.perf_counter() - start
+warmup = 0.0
+if {warmup}:
+    import main
+    start = time.perf_counter()
+    main.warmup()
+    warmup = time.perf_counter() - start
+json.dump({{"import_seconds": imported, "warmup_seconds": warmup}}, sys.stdout)
+"""
+
+
+def measure_startup(modules: List[str], samples: int, warmup: bool) -> dict:
+    """Times importing each module, and optionally main.warmup(), in fresh subprocesses."""
+    here = os.path.dirname(os.path.abspath(__file__))
+    report = {}
+    for module in modules:
+        runs = []
+        for _ in range(samples):
+            script = STARTUP_SCRIPT.format(module=module, warmup=warmup)
+            output = subprocess.run(
+                [sys.executable, "-c", script], cwd=here, check=True, capture_output=True, text=True
+            ).stdout
+            runs.append(json.loads(output.strip().splitlines()[-1]))
+        imports = [run["import_seconds"] for run in runs]
+        warmups = [run["warmup_seconds"] for run in runs]
+        report[module] = {
+            "samples": samples,
+            "import_p50": percentile(imports, 50),
+            "import_max": max(imports),
+            "warmup_p50": percentile(warmups, 50),
+        }
+    return report
+
+
+# Researches one company in a fresh interpreter, after warmup, and reports its RSS before and after
+REQUEST_RSS_SCRIPT = """
+import json, sys
+import benchmark, fakes, graph, main, utils
+utils.get_search().backend = fakes.PageSearchBackend({base_url!r}, [{company!r}], recorded_paths={recorded!r})
+main.warmup()
+baseline = benchmark.current_rss_mb()
+benchmark.reset_peak_rss()
+graph.get_graph().invoke(graph.AgentState(company_name={company!r}, refresh=True), config=graph.invoke_config())
+json.dump({{"baseline_mb": baseline, "peak_mb": benchmark.request_peak_rss_mb()}}, sys.stdout)
+"""
+
+
+def measure_request_rss(base_url: str, companies: List[str], recorded) -> dict:
+    """Runs each company's request alone in a fresh process and reports its peak RSS.
+
+    In one long-lived process the peak RSS only ever grows, so it can't be attributed to a
+    single request. Here the peak is reset after warmup where Linux allows it, and
+    "growth" is the peak during the request minus the RSS after warmup.
+    """
+    here = os.path.dirname(os.path.abspath(__file__))
+    runs = []
+    for company in companies:
+        script = REQUEST_RSS_SCRIPT.format(base_url=base_url, company=company, recorded=recorded)
+        output = subprocess.run(
+            [sys.executable, "-c", script], cwd=here, check=True, capture_output=True, text=True
+        ).stdout
+        runs.append(json.loads(output.strip().splitlines()[-1]))
+    peaks = [run["peak_mb"] for run in runs]
+    growth = [run["peak_mb"] - run["baseline_mb"] for run in runs]
+    return {
+        "requests": len(runs),
+        "peak_p50_mb": percentile(peaks, 50),
+        "peak_max_mb": max(peaks, default=0.0),
+        "growth_p50_mb": percentile(growth, 50),
+        "growth_max_mb": max(growth, default=0.0),
+    }
+
+
+def print_request_rss_report(report: dict):
+    print(
+        f"\n== peak RSS per request ({report['requests']} requests, fresh process each) ==\n"
+        f"  peak p50 {report['peak_p50_mb']:.1f} MB, max {report['peak_max_mb']:.1f} MB; "
+        f"growth over warmed-up process p50 {report['growth_p50_mb']:.1f} MB, max {report['growth_max_mb']:.1f} MB"
+    )
+
+
+def print_startup_report(report: dict):
+    print(f"\n== startup ==\n  {'module':<22}{'samples':>8}{'import p50 s':>14}{'import max s':>14}{'warmup p50 s':>14}")
+    for module, row in report.items():
+        print(
+            f"  {module:<22}{row['samples']:>8}{row['import_p50']:>14.3f}"
+            f"{row['import_max']:>14.3f}{row['warmup_p50']:>14.3f}"
+        )
+
+
+def print_report(report: dict):
+    print(f"\n== concurrency {report['concurrency']} ({report['label']}) ==")
+    latency = report["latency"]
+    print(
+        f"{report['companies']} companies in {report['wall_seconds']:.2f}s "
+        f"-> {report['companies_per_hour']:.0f} companies/hour; "
+        f"end-to-end p50 {latency['p50']:.3f}s p95 {latency['p95']:.3f}s"
+    )
+    memory = f"peak RSS {report['peak_rss_mb']:.1f} MB"
+    if report["heap_peak_mb"]:
+        memory += f", Python heap peak {report['heap_peak_mb']:.1f} MB"
+    print(memory)
+    for title, rows in (("node", report["nodes"]), ("stage", report["stages"])):
+        print(f"  {title:<22}{'count':>7}{'p50 s':>10}{'p95 s':>10}{'total s':>10}")
+        for name, row in rows.items():
+            print(f"  {name:<22}{row['count']:>7}{row['p50']:>10.3f}{row['p95']:>10.3f}{row['total']:>10.2f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the research pipeline offline.")
+    parser.add_argument("--companies", type=int, default=4, help="Companies researched per concurrency level")
+    parser.add_argument("--concurrency", default="1,4", help="Comma-separated numbers of graphs run at once")
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="Seconds the fake LLM takes per call")
+    parser.add_argument("--page-latency", type=float, default=0.0, help="Seconds the page server takes per page")
+    parser.add_argument("--pages-dir", help="Serve recorded HTML/PDF pages from this directory instead")
+    parser.add_argument("--tavily-rps", type=float, default=0, help="Tavily requests/second quota to enforce (0: none)")
+    parser.add_argument("--groq-rpm", type=float, default=0, help="Groq requests/minute quota to enforce (0: none)")
+    parser.add_argument("--groq-tpm", type=float, default=0, help="Groq tokens/minute quota to enforce (0: none)")
+    parser.add_argument("--extraction-mode", default="per_domain", choices=["per_domain", "combined"],
+                        help="One LLM call per domain, or one for all domains")
+    parser.add_argument("--real-embeddings", action="store_true", help="Use the FastEmbed model (needs it downloaded)")
+    parser.add_argument("--warm", action="store_true", help="Also rerun each level with warm caches")
+    parser.add_argument("--trace-memory", action="store_true", help="Track the Python heap peak (slower)")
+    parser.add_argument("--json", help="Write the full report to this file")
+    parser.add_argument("--rss", action="store_true", help="Also measure each request's peak RSS in a fresh process")
+    parser.add_argument("--startup", action="store_true", help="Measure cold import and warmup times instead")
+    parser.add_argument("--startup-samples", type=int, default=3, help="Fresh processes started per module")
+    parser.add_argument("--startup-modules", default="app,main,graph,utils", help="Comma-separated modules to import")
+    parser.add_argument("--no-warmup", action="store_true", help="With --startup, skip timing main.warmup()")
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix="research-bench-")
+    configure_environment(workdir, args)
+
+    if args.startup:
+        modules = [module.strip() for module in args.startup_modules.split(",") if module.strip()]
+        report = measure_startup(modules, args.startup_samples, warmup=not args.no_warmup)
+        print_startup_report(report)
+        if args.json:
+            with open(args.json, "w", encoding="utf-8") as outfile:
+                json.dump(report, outfile, indent=2)
+        return report
+
+    from fakes import PageServer, PageSearchBackend
+    import graph
+    import metrics
+    import utils
+
+    levels = [int(level) for level in args.concurrency.split(",") if level.strip()]
+    plan = {level: [f"Benchco{level}x{i:03d}" for i in range(args.companies)] for level in levels}
+
+    server = PageServer(latency=args.page_latency, pages_dir=args.pages_dir).start()
+    recorded = None
+    if args.pages_dir:
+        recorded = [
+            os.path.relpath(os.path.join(root, name), args.pages_dir).replace(os.sep, "/")
+            for root, _, names in os.walk(args.pages_dir) for name in names
+        ]
+    utils.get_search().backend = PageSearchBackend(
+        server.base_url, [name for names in plan.values() for name in names], recorded_paths=recorded
+    )
+
+    reports = []
+    try:
+        for level, companies in plan.items():
+            passes = ["cold"] + (["warm"] if args.warm else [])
+            for label in passes:
+                report = run_level(graph, metrics, companies, level, args.trace_memory)
+                report["label"] = label
+                print_report(report)
+                reports.append(report)
+        if args.rss:
+            rss_report = measure_request_rss(server.base_url, plan[levels[0]], recorded)
+            print_request_rss_report(rss_report)
+            reports.append({"request_rss": rss_report})
+    finally:
+        server.stop()
+
+    print(f"\nPage server handled {server.requests} requests; scratch files in {workdir}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as outfile:
+            json.dump(reports, outfile, indent=2)
+    return reports
+
+
+if __name__ == "__main__":
+    main()
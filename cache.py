@@ -0,0 +1,195 @@
+import hashlib
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional
+
+
+def hash_key(*parts) -> str:
+    """Returns a stable sha256 hex digest for the given key parts."""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(str(part).encode("utf-8"))
+        digest.update(b"\x00")
+    return digest.hexdigest()
+
+
+class LRUCache:
+    """Thread-safe in-memory cache with LRU eviction and an optional TTL (seconds).
+
+    With `max_bytes`, entries are also evicted once their total size, as measured by
+    `sizeof(value)`, passes it; a single value larger than `max_bytes` isn't kept.
+    """
+
+    def __init__(self, max_items: int = 1024, ttl: Optional[float] = None,
+                 max_bytes: Optional[int] = None, sizeof: Optional[Callable[[Any], int]] = None):
+        self.max_items = max_items
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()  # key -> (value, stored_at, size)
+        self._lock = threading.Lock()
+
+    def _pop(self, key: Hashable):
+        self.nbytes -= self._data.pop(key)[2]
+
+    def get(self, key: Hashable, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            value, stored_at, _ = entry
+            if self.ttl is not None and time.time() - stored_at > self.ttl:
+                self._pop(key)
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: Hashable, value: Any):
+        size = self.sizeof(value) if self.max_bytes is not None and self.sizeof else 0
+        with self._lock:
+            if key in self._data:
+                self._pop(key)
+            if self.max_bytes is not None and size > self.max_bytes:
+                return
+            self._data[key] = (value, time.time(), size)
+            self.nbytes += size
+            while len(self._data) > self.max_items or (self.max_bytes is not None and self.nbytes > self.max_bytes):
+                self._pop(next(iter(self._data)))
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.nbytes = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class DiskCache:
+    """Pickle-per-key cache in a local directory, expired by file age (seconds)."""
+
+    def __init__(self, directory: str, ttl: Optional[float] = None):
+        self.directory = directory
+        self.ttl = ttl
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], f"{key}.pkl")
+
+    def get(self, key: str, default=None):
+        path = self._path(key)
+        try:
+            if self.ttl is not None and time.time() - os.path.getmtime(path) > self.ttl:
+                os.remove(path)
+                return default
+            with open(path, "rb") as infile:
+                return pickle.load(infile)
+        except (OSError, pickle.PickleError, EOFError):
+            return default
+
+    def set(self, key: str, value: Any):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write to a temporary file first so concurrent readers never see a partial entry
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "wb") as outfile:
+                pickle.dump(value, outfile, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, path)
+        except (OSError, pickle.PickleError) as e:
+            print(f"Error writing cache entry {key}: {e}")
+
+
+class SingleFlight:
+    """Coalesces concurrent calls with the same key so only one of them does the work."""
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: Hashable, fn: Callable[[], Any]):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = {"done": threading.Event(), "result": None, "error": None}
+
+        if not leader:
+            call["done"].wait()
+            if call["error"] is not None:
+                raise call["error"]
+            return call["result"]
+
+        try:
+            call["result"] = fn()
+            return call["result"]
+        except Exception as e:
+            call["error"] = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call["done"].set()
+
+
+class SqliteCache:
+    """Key/value cache in a local SQLite file, shareable between worker processes."""
+
+    def __init__(self, path: str, ttl: Optional[float] = None, table: str = "cache"):
+        self.path = path
+        self.ttl = ttl
+        self.table = table
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {table} (key TEXT PRIMARY KEY, value BLOB, stored_at REAL)"
+            )
+
+    def get(self, key: str, default=None):
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT value, stored_at FROM {self.table} WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None:
+            return default
+        value, stored_at = row
+        if self.ttl is not None and time.time() - stored_at > self.ttl:
+            with self._lock, self._conn:
+                self._conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+            return default
+        return pickle.loads(value)
+
+    def set(self, key: str, value: Any):
+        blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        try:
+            with self._lock, self._conn:
+                self._conn.execute(
+                    f"INSERT OR REPLACE INTO {self.table} (key, value, stored_at) VALUES (?, ?, ?)",
+                    (key, blob, time.time()),
+                )
+        except sqlite3.Error as e:
+            print(f"Error writing cache entry {key}: {e}")
+
+
+def open_store(backend: str, path: Optional[str], ttl: Optional[float] = None, table: str = "cache"):
+    """Returns the persistent store named by `backend` ("disk" or "sqlite"), or None for memory only."""
+    if backend == "sqlite":
+        return SqliteCache(path or "cache.db", ttl=ttl, table=table)
+    if backend == "disk":
+        return DiskCache(path or os.path.join(".cache", table), ttl=ttl)
+    return None
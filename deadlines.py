@@ -0,0 +1,103 @@
+import contextvars
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from contextlib import contextmanager
+from typing import Optional
+
+import metrics
+
+# Deadline settings in seconds, overridable through the environment; 0 turns one off
+RUN_DEADLINE = float(os.getenv("RUN_DEADLINE", "90"))  # Whole research run, from the first node to the last
+STAGE_TIMEOUTS = {
+    "search": float(os.getenv("SEARCH_TIMEOUT", "15")),  # One search, including waiting for quota and retries
+    "fetch": float(os.getenv("FETCH_STAGE_TIMEOUT", "25")),  # Every page of a run, fetched and parsed
+    "embed": float(os.getenv("EMBED_TIMEOUT", "30")),  # Embedding one batch of a run's chunks
+    "llm": float(os.getenv("LLM_TIMEOUT", "45")),  # One extraction, including waiting for quota and retries
+}
+STAGE_WORKERS = int(os.getenv("STAGE_WORKERS", "64"))
+
+# Absolute time.monotonic() by which the current run must finish, or None
+_deadline: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar("deadline", default=None)
+
+# Runs the calls that are bounded by a timeout, so the caller can stop waiting for them
+_executor = ThreadPoolExecutor(max_workers=STAGE_WORKERS, thread_name_prefix="stage")
+
+
+@contextmanager
+def run_deadline(seconds: float = RUN_DEADLINE):
+    """Gives the block (and worker threads started with a copy of its context) `seconds` to finish."""
+    deadline = time.monotonic() + seconds if seconds > 0 else None
+    current = _deadline.get()
+    if current is not None and (deadline is None or current < deadline):
+        deadline = current  # A nested deadline can only shorten the outer one
+    token = _deadline.set(deadline)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def deadline_at(seconds: float = RUN_DEADLINE) -> Optional[float]:
+    """The wall-clock time (time.time()) `seconds` from now, or None if `seconds` is 0."""
+    return time.time() + seconds if seconds > 0 else None
+
+
+@contextmanager
+def until(timestamp: Optional[float]):
+    """Runs the block under a deadline given as a wall-clock time, e.g. one carried in the graph state."""
+    if timestamp is None:
+        yield
+        return
+    with run_deadline(max(timestamp - time.time(), 1e-9)):
+        yield
+
+
+def remaining() -> Optional[float]:
+    """Seconds left before the current run's deadline, or None if it has none."""
+    deadline = _deadline.get()
+    return None if deadline is None else max(0.0, deadline - time.monotonic())
+
+
+def expired() -> bool:
+    left = remaining()
+    return left is not None and left <= 0
+
+
+def cap(seconds: Optional[float]) -> Optional[float]:
+    """Shortens a timeout so it ends no later than the run's deadline."""
+    left = remaining()
+    if left is None:
+        return seconds
+    return left if seconds is None or seconds <= 0 else min(seconds, left)
+
+
+def stage_timeout(stage: str) -> Optional[float]:
+    """The time a stage may take now: its own timeout, cut short by the run's deadline."""
+    return cap(STAGE_TIMEOUTS.get(stage) or None)
+
+
+def run_with_timeout(stage: str, fn, *args, **kwargs):
+    """Calls `fn` and waits at most stage_timeout(stage) for it, raising TimeoutError after that.
+
+    Python can't interrupt a thread, so a call that times out keeps running in the
+    background; the caller just stops waiting for it. The call runs under a deadline of
+    its own, though, so quota waits and retries inside it (see ratelimit.call) give up
+    at the same moment instead of going on to reach the provider.
+    """
+    timeout = stage_timeout(stage)
+    if timeout is None:
+        return fn(*args, **kwargs)
+    if timeout <= 0:
+        metrics.inc("research_timeouts_total", stage=stage)
+        raise TimeoutError(f"no time left for {stage}")
+    def bounded():
+        with run_deadline(timeout):
+            return fn(*args, **kwargs)
+
+    future = metrics.submit(_executor, bounded)
+    try:
+        return future.result(timeout=timeout)
+    except FutureTimeoutError:
+        metrics.inc("research_timeouts_total", stage=stage)
+        raise TimeoutError(f"{stage} took longer than {timeout:.1f}s") from None
@@ -0,0 +1,130 @@
+import hashlib
+import os
+import re
+import zlib
+from typing import Dict, List
+
+import numpy as np
+
+import metrics
+
+# Dedup settings, overridable through the environment
+DEDUP_THRESHOLD = float(os.getenv("DEDUP_THRESHOLD", "0.8"))  # Estimated Jaccard similarity counted as a duplicate
+DEDUP_NUM_PERM = int(os.getenv("DEDUP_NUM_PERM", "128"))
+DEDUP_BANDS = int(os.getenv("DEDUP_BANDS", "32"))  # LSH bands; DEDUP_NUM_PERM must be a multiple of it
+SHINGLE_WORDS = 4
+MIN_CHUNK_WORDS = int(os.getenv("MIN_CHUNK_WORDS", "8"))  # Shorter chunks are dropped as boilerplate
+BOILERPLATE_RATIO = 0.3  # Share of a chunk's words coming from boilerplate phrases that marks it as junk
+
+_PRIME = (1 << 31) - 1
+_rng = np.random.default_rng(1)
+_PERM_A = _rng.integers(1, _PRIME, size=DEDUP_NUM_PERM, dtype=np.int64)
+_PERM_B = _rng.integers(0, _PRIME, size=DEDUP_NUM_PERM, dtype=np.int64)
+_BAND_WEIGHTS = _rng.integers(1, 1 << 31, size=DEDUP_NUM_PERM, dtype=np.int64)  # Wraps on overflow, which is fine for keys
+
+BOILERPLATE_PHRASES = re.compile(
+    r"\b(?:accept(?: all)? cookies?|we use cookies|cookie (?:policy|settings)|privacy policy|terms of (?:use|service)|"
+    r"all rights reserved|copyright \d{4}|subscribe to (?:our|the) newsletter|sign (?:in|up)|log ?in|"
+    r"share (?:on|this)|follow us|skip to (?:main )?content|advertisement|read more|related articles|"
+    r"enable javascript|contact us|about us)\b",
+    re.IGNORECASE,
+)
+_WORD = re.compile(r"\w+")
+
+
+def normalize(text: str) -> List[str]:
+    return _WORD.findall(text.lower())
+
+
+def is_boilerplate(text: str, words: List[str]) -> bool:
+    """True for chunks that are too short to carry facts or are mostly cookie, nav or footer text."""
+    if len(words) < MIN_CHUNK_WORDS:
+        return True
+    phrase_words = sum(len(match.split()) for match in BOILERPLATE_PHRASES.findall(text))
+    return phrase_words / len(words) >= BOILERPLATE_RATIO
+
+
+def shingle_hashes(words: List[str]) -> List[int]:
+    count = max(1, len(words) - SHINGLE_WORDS + 1)
+    return list({zlib.crc32(" ".join(words[i:i + SHINGLE_WORDS]).encode("utf-8")) for i in range(count)})
+
+
+def minhash_signatures(word_lists: List[List[str]]) -> np.ndarray:
+    """Returns one MinHash signature row per chunk, computed over its word shingles.
+
+    The shingles of every chunk are hashed in one vectorized pass and reduced per chunk,
+    instead of paying numpy's per-call overhead once per chunk.
+    """
+    if not word_lists:
+        return np.empty((0, DEDUP_NUM_PERM), dtype=np.int64)
+    per_chunk = [shingle_hashes(words) for words in word_lists]
+    offsets = np.cumsum([0] + [len(hashes) for hashes in per_chunk[:-1]])
+    hashes = np.fromiter((h for chunk in per_chunk for h in chunk), dtype=np.int64)
+    permuted = (_PERM_A[:, None] * hashes[None, :] + _PERM_B[:, None]) % _PRIME
+    return np.minimum.reduceat(permuted, offsets, axis=1).T
+
+
+class ChunkDeduper:
+    """Drops boilerplate, exact duplicate and near-duplicate chunks, keeping the first copy.
+
+    Chunks can be added a batch at a time, e.g. page by page as they are fetched; each
+    batch is checked against every chunk kept so far. Near duplicates (syndicated copies,
+    the same nav or footer on many pages) are found with MinHash signatures and LSH
+    banding, then confirmed by their estimated Jaccard similarity.
+    """
+
+    def __init__(self, threshold: float = DEDUP_THRESHOLD):
+        self.threshold = threshold
+        self.rows = DEDUP_NUM_PERM // DEDUP_BANDS
+        self.buckets: Dict[int, List[int]] = {}  # Band key -> indexes of kept signatures
+        self.signatures: List[np.ndarray] = []
+        self.seen_exact = set()
+        self.dropped = {"boilerplate": 0, "exact": 0, "near_duplicate": 0}
+
+    def add(self, chunks: list) -> list:
+        """Returns the chunks that aren't boilerplate or copies of a chunk kept before."""
+        candidates = []
+        for chunk in chunks:
+            text = chunk.page_content
+            words = normalize(text)
+            if is_boilerplate(text, words):
+                self.dropped["boilerplate"] += 1
+                continue
+            digest = hashlib.sha1(" ".join(words).encode("utf-8")).digest()
+            if digest in self.seen_exact:
+                self.dropped["exact"] += 1
+                continue
+            self.seen_exact.add(digest)
+            candidates.append((chunk, words))
+        if not candidates:
+            return []
+
+        signature_rows = minhash_signatures([words for _, words in candidates]).astype(np.uint32)  # Values are below 2^31
+        # One key per band: the band's rows folded into a single integer, tagged with the band number
+        folded = (signature_rows.reshape(len(candidates), DEDUP_BANDS, self.rows) * _BAND_WEIGHTS[:self.rows]).sum(axis=2)
+        band_keys = folded * DEDUP_BANDS + np.arange(DEDUP_BANDS)
+        kept = []
+        for (chunk, _), signature, keys in zip(candidates, signature_rows, band_keys.tolist()):
+            similar = {index for key in keys for index in self.buckets.get(key, ())}
+            if any(np.mean(self.signatures[index] == signature) >= self.threshold for index in similar):
+                self.dropped["near_duplicate"] += 1
+                continue
+
+            index = len(self.signatures)
+            self.signatures.append(signature)
+            for key in keys:
+                self.buckets.setdefault(key, []).append(index)
+            kept.append(chunk)
+        return kept
+
+    def nbytes(self) -> int:
+        """Rough memory held by the dedup state: signatures, band buckets and exact-match digests."""
+        return len(self.signatures) * (DEDUP_NUM_PERM * 4 + DEDUP_BANDS * 120) + len(self.seen_exact) * 100
+
+    def record(self):
+        """Counts the chunks dropped so far in research_chunks_dropped_total, by reason."""
+        for reason, count in self.dropped.items():
+            if count:
+                metrics.inc("research_chunks_dropped_total", count, reason=reason)
+            self.dropped[reason] = 0
+
@@ -0,0 +1,247 @@
+import hashlib
+import os
+import re
+import struct
+import threading
+from typing import Dict, List, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from cache import LRUCache
+import metrics
+
+# Embedding settings, overridable through the environment
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "fastembed")  # "fastembed", or "fake" for offline hashing embeddings
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "BAAI/bge-small-en-v1.5")
+if EMBEDDING_BACKEND == "fake":
+    EMBEDDING_MODEL = "fake-hashing"
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "256"))
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", "20000"))  # Vectors kept in memory
+EMBEDDING_CACHE_DIR = os.getenv("EMBEDDING_CACHE_DIR")  # The on-disk store is only used when this is set
+EMBEDDING_CACHE_MAX_MB = float(os.getenv("EMBEDDING_CACHE_MAX_MB", "512"))  # Per model file; compacted when full, 0 no limit
+
+_model = None
+_model_lock = threading.Lock()
+_embeddings = None
+
+
+def get_embedding_model(model_name: str = EMBEDDING_MODEL):
+    """Returns the process-wide FastEmbed model, loading it on first use."""
+    global _model
+    if _model is None:
+        with _model_lock:
+            if _model is None and EMBEDDING_BACKEND == "fake":
+                from fakes import HashingEmbeddings
+                _model = HashingEmbeddings()
+            elif _model is None:
+                from langchain_community.embeddings import FastEmbedEmbeddings
+                _model = FastEmbedEmbeddings(model_name=model_name)
+    return _model
+
+
+def get_embeddings() -> "CachedEmbeddings":
+    """Returns the shared cached embeddings used by every node."""
+    global _embeddings
+    if _embeddings is None:
+        with _model_lock:
+            if _embeddings is None:
+                store = None
+                if EMBEDDING_CACHE_DIR:
+                    store = MmapEmbeddingStore(EMBEDDING_CACHE_DIR, EMBEDDING_MODEL)
+                _embeddings = CachedEmbeddings(EMBEDDING_MODEL, store=store)
+    return _embeddings
+
+
+def text_key(text: str, query: bool = False) -> bytes:
+    """Returns the 32-byte cache key of a chunk of text (queries are embedded differently)."""
+    prefix = b"query\x00" if query else b"doc\x00"
+    return hashlib.sha256(prefix + text.encode("utf-8")).digest()
+
+
+class MmapEmbeddingStore:
+    """Append-only on-disk embedding store, read back as a memory-mapped float32 matrix.
+
+    Each model gets its own file: a 16-byte header holding the vector dimension,
+    followed by fixed-size (key, vector) records. Records are appended with a single
+    write so several processes can share the file, and keys already in the file are
+    not appended again. Once the file would grow past `max_mb`, it is rewritten with
+    its newest records, up to half that size, and swapped in atomically; every process
+    notices the new file and maps it afresh.
+    """
+
+    HEADER = struct.Struct("<4sI8x")
+    MAGIC = b"EMB1"
+
+    def __init__(self, directory: str, model_name: str, max_mb: float = EMBEDDING_CACHE_MAX_MB):
+        os.makedirs(directory, exist_ok=True)
+        slug = re.sub(r"[^A-Za-z0-9_.-]+", "_", model_name)
+        self.path = os.path.join(directory, f"{slug}.emb")
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.dim = None
+        self._dtype = None
+        self._map = None
+        self._count = 0  # Records mapped so far, duplicates included
+        self._inode = None  # Changes when the file is compacted
+        self._rows: Dict[bytes, int] = {}  # key -> its newest row
+        self._lock = threading.Lock()
+        self._refresh()
+
+    def _open(self, dim: int):
+        self.dim = dim
+        self._dtype = np.dtype([("key", "S32"), ("vector", "<f4", (dim,))])
+
+    def _refresh(self):
+        """Maps any records appended since the last refresh (by this or another process)."""
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return
+        if stat.st_size < self.HEADER.size:
+            return
+        if stat.st_ino != self._inode:
+            # A new or compacted file: the rows mapped so far no longer apply
+            self._map, self._count, self._rows = None, 0, {}
+            self._inode = stat.st_ino
+        if self.dim is None:
+            with open(self.path, "rb") as infile:
+                magic, dim = self.HEADER.unpack(infile.read(self.HEADER.size))
+            if magic != self.MAGIC:
+                raise ValueError(f"{self.path} is not an embedding store")
+            self._open(dim)
+        count = (stat.st_size - self.HEADER.size) // self._dtype.itemsize
+        if count <= self._count:
+            return
+        self._map = np.memmap(self.path, dtype=self._dtype, mode="r", offset=self.HEADER.size, shape=(count,))
+        keys = self._map["key"]
+        for row in range(self._count, count):
+            self._rows[bytes(keys[row])] = row
+        self._count = count
+
+    def _compact(self):
+        """Rewrites the file with its newest distinct records, up to half of max_bytes."""
+        keep = max(0, (self.max_bytes // 2 - self.HEADER.size) // self._dtype.itemsize)
+        rows = sorted(row for row in self._rows.values() if row >= self._count - keep)
+        records = self._map[rows] if rows else np.empty(0, dtype=self._dtype)
+        temp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(temp_path, "wb") as outfile:
+            outfile.write(self.HEADER.pack(self.MAGIC, self.dim))
+            outfile.write(records.tobytes())
+        self._map = None  # Unmapped first; Windows can't replace a mapped file
+        try:
+            os.replace(temp_path, self.path)
+        except OSError as e:
+            os.remove(temp_path)
+            print(f"Error compacting {self.path}: {e}")
+        else:
+            print(f"Compacted {self.path}: kept {len(rows)} of {self._count} vectors")
+        self._inode = None
+        self._refresh()
+
+    def get(self, key: bytes) -> Optional[np.ndarray]:
+        with self._lock:
+            row = self._rows.get(key)
+            if row is None:
+                self._refresh()
+                row = self._rows.get(key)
+            if row is None:
+                return None
+            return np.array(self._map["vector"][row])
+
+    def add_many(self, keys: List[bytes], vectors: np.ndarray):
+        with self._lock:
+            if self.dim is None:
+                try:
+                    with open(self.path, "xb") as outfile:
+                        outfile.write(self.HEADER.pack(self.MAGIC, vectors.shape[1]))
+                except FileExistsError:
+                    pass  # Another process created the store first
+                self._refresh()
+                if self.dim is None:
+                    self._open(vectors.shape[1])
+            if vectors.shape[1] != self.dim:
+                raise ValueError(f"Expected {self.dim}-dimensional vectors, got {vectors.shape[1]}")
+            self._refresh()  # Picks up keys other processes have stored meanwhile
+            new_rows = {}
+            for row, key in enumerate(keys):
+                if key not in self._rows:
+                    new_rows.setdefault(key, row)
+            if not new_rows:
+                return
+            records = np.empty(len(new_rows), dtype=self._dtype)
+            records["key"] = list(new_rows)
+            records["vector"] = vectors[list(new_rows.values())]
+            size = self.HEADER.size + (self._count + len(records)) * self._dtype.itemsize
+            if self.max_bytes and self._count and size > self.max_bytes:
+                self._compact()
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | getattr(os, "O_BINARY", 0))
+            try:
+                os.write(fd, records.tobytes())
+            finally:
+                os.close(fd)
+
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings backed by the shared model, with a cache keyed by model name and text hash.
+
+    Recent vectors are kept in a bounded in-memory LRU; when a store is given, new
+    vectors are also persisted there (up to its size limit) so other requests and
+    processes can reuse them.
+    """
+
+    def __init__(self, model_name: str = EMBEDDING_MODEL, store: Optional[MmapEmbeddingStore] = None,
+                 cache_size: int = EMBEDDING_CACHE_SIZE, batch_size: int = EMBED_BATCH_SIZE):
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.store = store
+        self._memory = LRUCache(cache_size)
+
+    def _lookup(self, key: bytes) -> Optional[np.ndarray]:
+        vector = self._memory.get(key)
+        if vector is None and self.store is not None:
+            vector = self.store.get(key)
+            if vector is not None:
+                self._memory.set(key, vector)
+        return vector
+
+    def embed_array(self, texts: List[str], query: bool = False) -> np.ndarray:
+        """Embeds the texts and returns them as a float32 matrix, one row per text."""
+        keys = [text_key(text, query) for text in texts]
+        vectors = {}
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key in vectors or key in missing:
+                continue
+            vector = self._lookup(key)
+            if vector is None:
+                missing[key] = text
+            else:
+                vectors[key] = vector
+
+        missing_keys = list(missing)
+        metrics.record_cache("embedding", hit=True, count=len(vectors))
+        metrics.record_cache("embedding", hit=False, count=len(missing_keys))
+        model = get_embedding_model(self.model_name) if missing_keys else None
+        for start in range(0, len(missing_keys), self.batch_size):
+            batch_keys = missing_keys[start:start + self.batch_size]
+            batch_texts = [missing[key] for key in batch_keys]
+            with metrics.span("embed", texts=len(batch_texts)):
+                if query:
+                    batch = np.asarray([model.embed_query(text) for text in batch_texts], dtype=np.float32)
+                else:
+                    batch = np.asarray(model.embed_documents(batch_texts), dtype=np.float32)
+            for key, vector in zip(batch_keys, batch):
+                vectors[key] = vector
+                self._memory.set(key, vector)
+            if self.store is not None:
+                self.store.add_many(batch_keys, batch)
+
+        if not keys:
+            return np.empty((0, 0), dtype=np.float32)
+        return np.stack([vectors[key] for key in keys])
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.embed_array(texts).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_array([text], query=True)[0].tolist()
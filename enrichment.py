@@ -0,0 +1,40 @@
+import os
+import threading
+from typing import Callable, Optional
+
+from jobs import JobManager
+
+# Competitors without a fresh profile are researched in the background, on a small pool of their own
+ENRICH_WORKERS = int(os.getenv("ENRICH_WORKERS", "1"))
+ENRICH_MAX_PENDING = int(os.getenv("ENRICH_MAX_PENDING", "50"))  # Further competitors are dropped until it drains
+ENRICH_COMPETITORS = os.getenv("ENRICH_COMPETITORS", "1").lower() in ("1", "true", "yes")
+
+# Set by configure(); background research is off until a runner is registered
+_jobs: Optional[JobManager] = None
+_lock = threading.Lock()
+
+
+def configure(run: Callable[[str], dict]):
+    """Registers how a company is researched in the background, e.g. main.run_agent with enrich=False.
+
+    Enrichment runs must not enrich their own competitors in turn, so one request
+    can't set off a crawl of the whole industry.
+    """
+    global _jobs
+    with _lock:
+        if _jobs is None:
+            _jobs = JobManager(
+                run,
+                workers=ENRICH_WORKERS,
+                ttl=0,  # Results land in the stores; the jobs themselves needn't be kept
+                max_active=ENRICH_MAX_PENDING,
+            )
+        else:
+            _jobs.run = run
+
+
+def enrich_company(company_name: str) -> bool:
+    """Queues background research of a company without waiting for it. Returns False if it wasn't queued."""
+    if not ENRICH_COMPETITORS or _jobs is None:
+        return False
+    return _jobs.submit(company_name) is not None
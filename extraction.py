@@ -0,0 +1,206 @@
+import codecs
+import os
+import re
+from io import BytesIO
+from typing import Optional
+
+# Extraction settings, overridable through the environment
+EXTRACT_MIN_CHARS = int(os.getenv("EXTRACT_MIN_CHARS", "200"))  # Shorter fast-path text falls back to Unstructured
+EXTRACT_MAX_PDF_PAGES = int(os.getenv("EXTRACT_MAX_PDF_PAGES", "200"))
+
+# Elements that never hold the main text of a page
+SKIP_TAGS = ("script", "style", "noscript", "template", "svg", "canvas", "iframe", "form", "button", "select",
+             "nav", "header", "footer", "aside", "menu")
+
+# class/id fragments of navigation, cookie banners, share bars and other page furniture
+BOILERPLATE = re.compile(
+    r"cookie|consent|banner|nav|menu|footer|header|sidebar|breadcrumb|share|social|subscribe|newsletter|"
+    r"comment|related|promo|advert|\bads?\b|sponsor|popup|modal|signup|login|masthead|skip",
+    re.IGNORECASE,
+)
+# ...unless they also look like the content itself
+CONTENT_HINTS = re.compile(r"article|content|story|post|entry|main|body|text", re.IGNORECASE)
+
+# A charset declared in the page itself, looked for near the start like browsers do
+META_CHARSET = re.compile(rb"""<meta[^>]+charset\s*=\s*["']?\s*([\w.:-]+)""", re.IGNORECASE)
+# Labels browsers read as windows-1252, its superset
+WINDOWS_1252_ALIASES = ("latin-1", "iso8859-1", "ascii")
+
+BLOCK_TAGS = ("p", "h1", "h2", "h3", "h4", "h5", "h6", "li", "blockquote", "pre", "td", "th", "dd", "dt", "figcaption")
+
+
+def sniff_content_type(url: str, content: bytes, content_type: str = "") -> str:
+    """Returns "pdf", "html" or "text" for a downloaded body, or "other" if it can't be parsed.
+
+    Magic bytes win over the Content-Type header, which wins over the URL suffix, so PDFs
+    served from extensionless URLs or as application/octet-stream are still recognised.
+    """
+    head = content[:1024].lstrip(b"\xef\xbb\xbf \t\r\n").lower()
+    if b"%PDF-" in content[:1024]:
+        return "pdf"
+    if head.startswith((b"<!doctype html", b"<html", b"<?xml")) or b"<html" in head or b"<body" in head:
+        return "html"
+
+    content_type = content_type.split(";", 1)[0].strip().lower()
+    if content_type == "application/pdf":
+        return "pdf"
+    if content_type in ("text/html", "application/xhtml+xml"):
+        return "html"
+    if content_type.startswith("text/") or content_type in ("application/json", "application/xml"):
+        return "text"
+    if content_type.startswith(("image/", "video/", "audio/", "font/")):
+        return "other"
+
+    path = url.split("?", 1)[0].split("#", 1)[0].lower()
+    if path.endswith(".pdf"):
+        return "pdf"
+    if head.startswith(b"<"):
+        return "html"
+    return "text" if b"\x00" not in head else "other"
+
+
+def charset_param(content_type: str) -> Optional[str]:
+    """Returns the charset parameter of a Content-Type header, if any."""
+    for param in content_type.split(";")[1:]:
+        name, _, value = param.partition("=")
+        if name.strip().lower() == "charset" and value.strip(" \t\"'"):
+            return value.strip(" \t\"'")
+    return None
+
+
+def _known_encoding(name: Optional[str]) -> Optional[str]:
+    try:
+        encoding = codecs.lookup(name).name if name else None
+    except LookupError:
+        return None
+    return "cp1252" if encoding in WINDOWS_1252_ALIASES else encoding
+
+
+def detect_encoding(content: bytes, declared: Optional[str] = None, html: bool = False) -> str:
+    """Picks the encoding of a body the way browsers do.
+
+    A byte order mark wins, then the charset `declared` in the Content-Type header,
+    then (for HTML) a <meta> charset. Failing those, the body is read as UTF-8 if it
+    decodes as such and as windows-1252 otherwise.
+    """
+    if content.startswith(codecs.BOM_UTF8):
+        return "utf-8-sig"
+    if content.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+        return "utf-16"
+    meta = META_CHARSET.search(content[:4096]) if html else None
+    for name in (declared, meta and meta.group(1).decode("ascii")):
+        encoding = _known_encoding(name)
+        if encoding:
+            return encoding
+    try:
+        codecs.getincrementaldecoder("utf-8")().decode(content[:65536])  # Not final: the cut may split a character
+    except UnicodeDecodeError:
+        return "cp1252"
+    return "utf-8"
+
+
+def _is_boilerplate(element) -> bool:
+    names = f"{element.get('class', '')} {element.get('id', '')} {element.get('role', '')}"
+    return bool(BOILERPLATE.search(names)) and not CONTENT_HINTS.search(names)
+
+
+def _text_length(element) -> int:
+    return len(" ".join(element.text_content().split()))
+
+
+def _link_density(element) -> float:
+    length = _text_length(element)
+    if not length:
+        return 1.0
+    return sum(_text_length(link) for link in element.iter("a")) / length
+
+
+def _best_container(root):
+    """Picks the element holding the main text, readability style.
+
+    Every paragraph adds its length to its parent and half of it to its grandparent;
+    the container with the highest score, discounted by its link density, wins.
+    """
+    scores = {}
+    for paragraph in root.iter("p", "pre", "blockquote", "td"):
+        length = _text_length(paragraph)
+        if length < 25:
+            continue
+        score = 1 + min(length // 100, 3) + length / 100
+        parent = paragraph.getparent()
+        if parent is None:
+            continue
+        scores[parent] = scores.get(parent, 0) + score
+        grandparent = parent.getparent()
+        if grandparent is not None:
+            scores[grandparent] = scores.get(grandparent, 0) + score / 2
+    if not scores:
+        return None
+    return max(scores, key=lambda element: scores[element] * (1 - _link_density(element)))
+
+
+def extract_html_text(content: bytes, min_chars: int = EXTRACT_MIN_CHARS,
+                      encoding: Optional[str] = None) -> Optional[str]:
+    """Extracts the main text of an HTML page with lxml.
+
+    `encoding` is the charset from the Content-Type header, if any (see detect_encoding).
+    Returns None when the page yields too little text (e.g. it is rendered by
+    JavaScript or laid out in an unusual way), so the caller can fall back to Unstructured.
+    """
+    import lxml.html
+    from lxml import etree
+
+    encoding = detect_encoding(content, encoding, html=True)
+    if encoding == "utf-8-sig":
+        content, encoding = content[len(codecs.BOM_UTF8):], "utf-8"
+    try:
+        root = lxml.html.document_fromstring(content, parser=lxml.html.HTMLParser(encoding=encoding))
+    except (etree.ParserError, ValueError, LookupError):
+        return None
+    for element in list(root.iter(*SKIP_TAGS, etree.Comment)):
+        element.drop_tree()
+    for element in [element for element in root.iter("div", "section", "ul", "p", "span") if _is_boilerplate(element)]:
+        if element.getparent() is not None:
+            element.drop_tree()
+
+    container = _best_container(root)
+    for fallback in (next(root.iter("article", "main"), None), root.find("body"), root):
+        if container is None:
+            container = fallback
+    blocks = []
+    for element in container.iter(*BLOCK_TAGS):
+        if element.getparent() is not None and element.getparent().tag in BLOCK_TAGS:
+            continue  # Already included in its parent's text
+        text = " ".join(element.text_content().split())
+        if text:
+            blocks.append(text)
+    text = "\n\n".join(blocks) or " ".join(container.text_content().split())
+
+    title = root.findtext(".//title")
+    if title and title.strip() and not text.startswith(title.strip()):
+        text = f"{title.strip()}\n\n{text}"
+    return text if len(text) >= min_chars else None
+
+
+def extract_pdf_text(content: bytes) -> Optional[str]:
+    """Extracts the text layer of a PDF with pypdf.
+
+    Returns None when pypdf isn't installed or the PDF has no usable text layer
+    (scanned pages, broken files), so the caller can fall back to Unstructured.
+    """
+    try:
+        from pypdf import PdfReader
+    except ImportError:
+        return None
+    try:
+        reader = PdfReader(BytesIO(content))
+        pages = [page.extract_text() or "" for page in reader.pages[:EXTRACT_MAX_PDF_PAGES]]
+    except Exception:
+        return None
+    text = "\n\n".join(page.strip() for page in pages if page.strip())
+    return text if len(text) >= EXTRACT_MIN_CHARS else None
+
+
+def extract_text(content: bytes, encoding: Optional[str] = None) -> str:
+    """Decodes a plain text body, in the header's `encoding` if it gives one (see detect_encoding)."""
+    return content.decode(detect_encoding(content, encoding), errors="replace")
@@ -0,0 +1,235 @@
+# Deterministic local stand-ins for Tavily, Groq, FastEmbed and the web, used by benchmark.py
+# (and selectable with LLM_BACKEND=fake / EMBEDDING_BACKEND=fake) to run without keys or network.
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Optional
+from urllib.parse import quote, unquote
+
+import numpy as np
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+WORDS = (
+    "revenue growth market share customers regulation platform delivery partners "
+    "expansion quarterly profit margin investors competition pricing subscription "
+    "logistics compliance lobbying policy audience brand sentiment lawsuit filing "
+    "acquisition strategy segment demand supply analysts forecast operations"
+).split()
+
+
+def _seed(*parts) -> int:
+    return int(hashlib.sha256("\x00".join(map(str, parts)).encode("utf-8")).hexdigest()[:12], 16)
+
+
+class FakeResearchLLM(BaseChatModel):
+    """Chat model that answers extraction prompts with deterministic, schema-valid JSON."""
+
+    latency: float = 0.0  # Seconds to sleep per call, to mimic a Groq round trip
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-research"
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        prompt = messages[-1].content
+        if self.latency:
+            time.sleep(self.latency)
+        rng = random.Random(_seed(prompt))
+        sentence = " ".join(rng.choice(WORDS) for _ in range(12))
+        if "competitors of" in prompt:
+            payload = {"competitors": [
+                {"company_name": f"Rival {rng.randint(1, 50)}", "summary": sentence, "key_metrics": {"revenue": "NA"}}
+                for _ in range(3)
+            ]}
+        elif "in these domains:" in prompt:
+            domains = re.search(r"in these domains: ([^.]*)\.", prompt).group(1).split(", ")
+            payload = {"domains": {
+                domain: {"summary": f"{domain}: {sentence}", "market_trends": [rng.choice(WORDS) for _ in range(3)], "news_links": []}
+                for domain in domains
+            }}
+        else:
+            payload = {"summary": sentence, "market_trends": [rng.choice(WORDS) for _ in range(3)], "news_links": []}
+        content = json.dumps(payload)
+        usage = {"input_tokens": len(prompt) // 4, "output_tokens": len(content) // 4}
+        usage["total_tokens"] = usage["input_tokens"] + usage["output_tokens"]
+        message = AIMessage(content=content, usage_metadata=usage)
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+
+class HashingEmbeddings:
+    """Bag-of-words hashing embeddings: fast, deterministic and needing no model download."""
+
+    def __init__(self, dim: int = 384):
+        self.dim = dim
+
+    def _embed(self, text: str) -> List[float]:
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for token in re.findall(r"\w+", text.lower()):
+            vector[_seed(token) % self.dim] += 1.0
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed(text)
+
+
+def generate_html(company: str, page_id: int, paragraphs: int = 30) -> bytes:
+    """Returns a news-style page about the company, with the usual nav and footer boilerplate."""
+    rng = random.Random(_seed(company, page_id))
+    body = "\n".join(
+        f"<p>{company} " + " ".join(rng.choice(WORDS) for _ in range(rng.randint(40, 90))) + ".</p>"
+        for _ in range(paragraphs)
+    )
+    return f"""<!DOCTYPE html>
+<html><head><title>{company} report {page_id}</title></head>
+<body>
+<nav><a href="/">Home</a> <a href="/markets">Markets</a> <a href="/tech">Tech</a> <a href="/about">About us</a></nav>
+<div class="cookie-banner">We use cookies to improve your experience. Accept all cookies.</div>
+<article><h1>{company} report {page_id}</h1>
+{body}
+</article>
+<footer>Copyright 2024 Example News. All rights reserved. Privacy policy. Terms of use.</footer>
+</body></html>""".encode("utf-8")
+
+
+def generate_pdf(company: str, page_id: int, lines: int = 60) -> bytes:
+    """Returns a single-page PDF report about the company."""
+    rng = random.Random(_seed(company, page_id, "pdf"))
+    text_ops = ["BT /F1 10 Tf 40 800 Td 12 TL"]
+    for _ in range(lines):
+        line = f"{company} " + " ".join(rng.choice(WORDS) for _ in range(10))
+        text_ops.append(f"({line}) '")
+    text_ops.append("ET")
+    stream = "\n".join(text_ops).encode("latin-1")
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
+        b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 842] /Contents 4 0 R "
+        b"/Resources << /Font << /F1 5 0 R >> >> >>",
+        b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream",
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    pdf = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(pdf))
+        pdf += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref = len(pdf)
+    pdf += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for offset in offsets:
+        pdf += b"%010d 00000 n \n" % offset
+    pdf += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    return bytes(pdf)
+
+
+class PageServer:
+    """Local HTTP server for benchmark pages.
+
+    Serves generated pages at /<company>/<id>.html and /<company>/<id>.pdf, or, when
+    `pages_dir` is given, recorded pages from that directory by path.
+    """
+
+    def __init__(self, latency: float = 0.0, pages_dir: Optional[str] = None):
+        self.latency = latency
+        self.pages_dir = pages_dir
+        self.requests = 0
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                server.requests += 1
+                if server.latency:
+                    time.sleep(server.latency)
+                found = server.render(self.path)
+                if found is None:
+                    self.send_error(404)
+                    return
+                body, content_type = found
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self._httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._httpd.daemon_threads = True
+        self.base_url = f"http://127.0.0.1:{self._httpd.server_port}"
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+
+    def render(self, path: str):
+        path = path.split("?", 1)[0]
+        if self.pages_dir:
+            root = os.path.abspath(self.pages_dir)
+            file_path = os.path.abspath(os.path.join(root, unquote(path).lstrip("/")))
+            if not file_path.startswith(root + os.sep) or not os.path.isfile(file_path):
+                return None
+            with open(file_path, "rb") as infile:
+                body = infile.read()
+            return body, "application/pdf" if file_path.endswith(".pdf") else "text/html; charset=utf-8"
+        match = re.fullmatch(r"/([^/]+)/(\d+)\.(html|pdf)", path)
+        if not match:
+            return None
+        company, page_id, kind = unquote(match.group(1)), int(match.group(2)), match.group(3)
+        if kind == "pdf":
+            return generate_pdf(company, page_id), "application/pdf"
+        return generate_html(company, page_id), "text/html; charset=utf-8"
+
+    def start(self) -> "PageServer":
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+
+class PageSearchBackend:
+    """Search backend returning pages from a PageServer for whichever company a query names.
+
+    Each company has a pool of pages and each query picks a deterministic subset of it,
+    so, as with real searches, the domains of one company share some of their URLs.
+    """
+
+    def __init__(self, base_url: str, companies: List[str], pool_size: int = 12, results: int = 5,
+                 pdf_every: int = 4, recorded_paths: Optional[List[str]] = None):
+        self.base_url = base_url
+        self.companies = sorted(companies, key=len, reverse=True)  # Longest first, so "Acme Labs" beats "Acme"
+        self.pool_size = pool_size
+        self.results = results
+        self.pdf_every = pdf_every
+        self.recorded_paths = recorded_paths
+        self.calls = 0
+
+    def search(self, query: str, search_depth: str) -> List[dict]:
+        self.calls += 1
+        rng = random.Random(_seed(query))
+        if self.recorded_paths:
+            paths = rng.sample(self.recorded_paths, min(self.results, len(self.recorded_paths)))
+            return [{"url": f"{self.base_url}/{path.lstrip('/')}", "title": path, "content": ""} for path in paths]
+
+        company = next((name for name in self.companies if name in query), None)
+        if company is None:
+            return []
+        page_ids = rng.sample(range(self.pool_size), min(self.results, self.pool_size))
+        results = []
+        for page_id in page_ids:
+            kind = "pdf" if self.pdf_every and page_id % self.pdf_every == 0 else "html"
+            results.append({
+                "url": f"{self.base_url}/{quote(company)}/{page_id}.{kind}",
+                "title": f"{company} report {page_id}",
+                "content": f"{company} {' '.join(rng.choice(WORDS) for _ in range(20))}",
+            })
+        return results
@@ -0,0 +1,212 @@
+import hashlib
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, TimeoutError as FutureTimeoutError, as_completed, wait
+from typing import Callable, Iterator, List, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from cache import LRUCache, DiskCache, SingleFlight, hash_key
+import deadlines
+import metrics
+
+# Fetch settings, overridable through the environment
+FETCH_WORKERS = int(os.getenv("FETCH_WORKERS", "8"))
+FETCH_TIMEOUT = float(os.getenv("FETCH_TIMEOUT", "20"))
+FETCH_CACHE_SIZE = int(os.getenv("FETCH_CACHE_SIZE", "512"))
+FETCH_CACHE_MAX_MB = float(os.getenv("FETCH_CACHE_MAX_MB", "64"))  # Chunk text kept across runs, for all pages together
+FETCH_CACHE_DIR = os.getenv("FETCH_CACHE_DIR")  # The on-disk cache is only used when this is set
+FETCH_CACHE_TTL = float(os.getenv("FETCH_CACHE_TTL", "86400"))
+FETCH_MAX_BYTES = int(os.getenv("FETCH_MAX_BYTES", str(10 * 1024 * 1024)))  # Larger bodies are abandoned
+FETCH_MAX_SECONDS = float(os.getenv("FETCH_MAX_SECONDS", "30"))  # Total time allowed to read one body
+FETCH_HEDGE_AFTER = float(os.getenv("FETCH_HEDGE_AFTER", "3"))  # Send a duplicate request if a page is this slow; 0 never
+FETCH_CHUNK_BYTES = 64 * 1024
+
+# Content types that can never be parsed, rejected before their body is read
+UNPARSEABLE_TYPES = ("image/", "video/", "audio/", "font/")
+
+USER_AGENT = "Mozilla/5.0 (compatible; company-research-agent/1.0)"
+
+# parse(url, content, content_type) -> list of chunked documents
+ParseFn = Callable[[str, bytes, str], list]
+
+
+def chunks_size(chunks: list) -> int:
+    """Memory held by a list of chunks and their text."""
+    return sum(sys.getsizeof(chunk) + sys.getsizeof(chunk.page_content) for chunk in chunks)
+
+
+class DocumentFetcher:
+    """Downloads pages over pooled connections and caches their chunked documents.
+
+    Chunks are cached both by URL and by a hash of the downloaded content, so a page
+    served from two different URLs is only parsed once. Concurrent requests for the
+    same URL share a single download.
+    """
+
+    def __init__(
+        self,
+        workers: int = FETCH_WORKERS,
+        timeout: float = FETCH_TIMEOUT,
+        max_bytes: int = FETCH_MAX_BYTES,
+        max_seconds: float = FETCH_MAX_SECONDS,
+        hedge_after: float = FETCH_HEDGE_AFTER,
+        cache_size: int = FETCH_CACHE_SIZE,
+        cache_max_mb: float = FETCH_CACHE_MAX_MB,
+        cache_dir: Optional[str] = FETCH_CACHE_DIR,
+        cache_ttl: float = FETCH_CACHE_TTL,
+    ):
+        self.timeout = timeout
+        self.max_bytes = max_bytes
+        self.max_seconds = max_seconds
+        self.hedge_after = hedge_after
+        self.workers = workers
+        self.session = requests.Session()
+        self.session.headers["User-Agent"] = USER_AGENT
+        adapter = HTTPAdapter(pool_connections=workers, pool_maxsize=workers)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="fetch")
+        # Downloads run on their own pool so a fetch worker can wait for a request and its hedge
+        self._download_executor = ThreadPoolExecutor(max_workers=2 * workers, thread_name_prefix="download")
+        self._url_cache = LRUCache(cache_size, ttl=cache_ttl)  # (url, variant) -> content hash
+        # (content hash, variant) -> chunks; bounded by size too, since it keeps chunk text alive after indexing
+        self._chunk_cache = LRUCache(cache_size, max_bytes=int(cache_max_mb * 1024 * 1024), sizeof=chunks_size)
+        self._disk = DiskCache(cache_dir, ttl=cache_ttl) if cache_dir else None
+        self._inflight = SingleFlight()
+
+    def download(self, url: str):
+        """Downloads a URL and returns its body and content type.
+
+        The body is streamed and abandoned with a ValueError once it exceeds `max_bytes`
+        or takes longer than `max_seconds` to read (`timeout` only bounds each socket
+        read). Media types that can't be parsed are rejected before their body is read.
+        """
+        with metrics.span("fetch", url=url):
+            deadline = time.monotonic() + deadlines.cap(self.max_seconds)  # Never past the run's deadline
+            with self.session.get(url, timeout=self.timeout, stream=True) as response:
+                response.raise_for_status()
+                content_type = response.headers.get("Content-Type", "")
+                if content_type.lower().startswith(UNPARSEABLE_TYPES):
+                    raise ValueError(f"unsupported content type {content_type}")
+                declared = response.headers.get("Content-Length")
+                if declared and declared.isdigit() and int(declared) > self.max_bytes:
+                    raise ValueError(f"body of {declared} bytes exceeds FETCH_MAX_BYTES")
+
+                body = bytearray()
+                for chunk in response.iter_content(FETCH_CHUNK_BYTES):
+                    body += chunk
+                    if len(body) > self.max_bytes:
+                        raise ValueError(f"body exceeds FETCH_MAX_BYTES ({self.max_bytes} bytes)")
+                    if time.monotonic() > deadline:
+                        raise ValueError(f"body took longer than FETCH_MAX_SECONDS ({self.max_seconds}s)")
+        metrics.inc("research_bytes_fetched_total", len(body))
+        return bytes(body), content_type
+
+    def download_hedged(self, url: str):
+        """Downloads a URL, sending a duplicate request if the first hasn't finished after `hedge_after`.
+
+        Whichever request succeeds first wins; a slow server or a stalled connection then
+        costs at most `hedge_after` plus one normal download.
+        """
+        first = metrics.submit(self._download_executor, self.download, url)
+        if self.hedge_after <= 0 or wait([first], timeout=self.hedge_after).done:
+            return first.result()
+
+        second = metrics.submit(self._download_executor, self.download, url)
+        error = None
+        try:
+            for future in as_completed([first, second], timeout=deadlines.cap(self.max_seconds)):
+                try:
+                    result = future.result()
+                except Exception as e:
+                    error = e
+                    continue
+                metrics.inc("research_hedged_fetches_total", winner="hedge" if future is second else "first")
+                return result
+        except FutureTimeoutError:
+            error = TimeoutError(f"no response from {url} within the fetch time limit")
+        metrics.inc("research_hedged_fetches_total", winner="none")
+        raise error
+
+    def _cached_chunks(self, url: str, variant: str):
+        content_hash = self._url_cache.get((url, variant))
+        if content_hash is not None:
+            chunks = self._chunk_cache.get((content_hash, variant))
+            if chunks is not None:
+                return chunks
+        if self._disk is not None:
+            entry = self._disk.get(hash_key("url", url, variant))
+            if entry is not None:
+                self._url_cache.set((url, variant), entry["hash"])
+                self._chunk_cache.set((entry["hash"], variant), entry["chunks"])
+                return entry["chunks"]
+        return None
+
+    def _load(self, url: str, parse: ParseFn, variant: str):
+        chunks = self._cached_chunks(url, variant)
+        metrics.record_cache("fetch", hit=chunks is not None)
+        if chunks is not None:
+            return chunks
+
+        content, content_type = self.download_hedged(url)
+        content_hash = hashlib.sha256(content).hexdigest()
+        chunks = self._chunk_cache.get((content_hash, variant))
+        metrics.record_cache("content", hit=chunks is not None)
+        if chunks is None:
+            chunks = parse(url, content, content_type)
+
+        self._url_cache.set((url, variant), content_hash)
+        self._chunk_cache.set((content_hash, variant), chunks)
+        if self._disk is not None:
+            self._disk.set(hash_key("url", url, variant), {"hash": content_hash, "chunks": chunks})
+        return chunks
+
+    def fetch(self, url: str, parse: ParseFn, variant: str = "") -> list:
+        """Returns the chunked documents for a URL, downloading and parsing it if needed.
+
+        `variant` identifies the parse settings (e.g. chunk size) so differently chunked
+        copies of the same page are cached separately.
+        """
+        try:
+            return self._inflight.do((url, variant), lambda: self._load(url, parse, variant))
+        except Exception as e:
+            metrics.record_error("fetch")
+            print(f"Error fetching {url}: {e}")
+            return []
+
+    def iter_many(self, urls: List[str], parse: ParseFn, variant: str = "") -> Iterator[Tuple[str, list]]:
+        """Fetches the URLs concurrently and yields (url, chunks) for each page as soon as it's ready.
+
+        Only as many pages as there are fetch workers are in flight ahead of the consumer,
+        so at most that many raw bodies (and their hedges) and unconsumed results are held
+        at once, and a consumer that stops early doesn't cause the rest to be downloaded.
+        Closing the generator cancels the pages not started yet. Stops waiting after the
+        "fetch" stage timeout (see deadlines); pages that aren't ready by then are skipped,
+        and the ones already downloading are cached for later runs once they finish.
+        """
+        queue = list(dict.fromkeys(urls))
+        total = len(queue)
+        queue.reverse()  # Popped from the end, in the order given
+        pending = {}
+        timeout = deadlines.stage_timeout("fetch")
+        give_up = None if timeout is None else time.monotonic() + timeout
+        try:
+            while queue or pending:
+                while queue and len(pending) < self.workers:
+                    url = queue.pop()
+                    pending[metrics.submit(self._executor, self.fetch, url, parse, variant)] = url
+                left = None if give_up is None else max(0.0, give_up - time.monotonic())
+                done, _ = wait(pending, timeout=left, return_when=FIRST_COMPLETED)
+                if not done:
+                    late = len(pending) + len(queue)
+                    metrics.inc("research_timeouts_total", late, stage="fetch")
+                    print(f"Skipping {late} of {total} pages not fetched within {timeout:.1f}s")
+                    return
+                for future in done:
+                    yield pending.pop(future), future.result()
+        finally:
+            for future in pending:
+                future.cancel()
@@ -1,6 +1,11 @@
 import React, { useState } from "react";
 import { Search, Building2, Globe, Loader2 } from "lucide-react";
-import { parse } from "yaml";
+
+interface Competitor {
+  company_name: string;
+  summary?: string;
+  key_metrics?: Record<string, string | null>;
+}
 
 interface CompanyData {
   name?: string;
@@ -13,6 +18,7 @@ interface CompanyData {
   products?: string[];
   competitors?: string[];
   revenue?: string;
+  domains?: Record<string, any>; // Streamed results by domain name, e.g. domains.competitors
   [key: string]: any;
 }
 
@@ -23,32 +29,43 @@ function App() {
   const [companyData, setCompanyData] = useState<CompanyData | null>(null); // To store the company data fetched from backend
 
   // Handle form submission
-  const handleSubmit = async (e: React.FormEvent) => {
+  const handleSubmit = (e: React.FormEvent) => {
     e.preventDefault();
     setIsLoading(true);
     setError(""); // Reset error message
+    setCompanyData({ name: input });
+
+    // Stream each domain's results from the Flask backend as soon as it is ready
+    const events = new EventSource(
+      `http://localhost:5000/agent/stream?company=${encodeURIComponent(input)}`
+    );
+
+    events.addEventListener("result", (event) => {
+      const { name, data } = JSON.parse((event as MessageEvent).data);
+      // Kept apart from the top-level fields, which have different shapes (e.g. competitors)
+      setCompanyData((previous) => ({
+        ...previous,
+        domains: { ...previous?.domains, [name]: data },
+      }));
+    });
+
+    events.addEventListener("complete", () => {
+      events.close();
+      setIsLoading(false);
+    });
 
-    try {
-      // Make the API call to the Flask backend with the company name
-      const response = await fetch(
-        `http://localhost:5000/agent?company=${input}`
-      );
-
-      if (!response.ok) {
-        throw new Error("Failed to fetch data");
-      }
-
-      // Get the response text (YAML data) and parse it
-      const yamlResponse = await response.text();
-      const parsedData = parse(yamlResponse); // Convert YAML into JSON
-      setCompanyData(parsedData); // Set the parsed data into the state
-    } catch (err) {
+    // Covers both "error" events sent by the backend and connection failures
+    events.addEventListener("error", () => {
+      events.close();
       setError("Failed to fetch company data. Please try again.");
-    } finally {
       setIsLoading(false);
-    }
+    });
   };
 
+  // Streamed competitors are objects, not the plain names the top-level field holds
+  const competitors: (Competitor | string)[] =
+    companyData?.domains?.competitors ?? companyData?.competitors ?? [];
+
   return (
     <div className="min-h-screen bg-gradient-to-br from-blue-50 to-indigo-50">
       <div className="max-w-4xl mx-auto px-4 py-12">
@@ -175,8 +192,12 @@ function App() {
                     Competitors
                   </h3>
                   <ul className="mt-1 list-disc list-inside text-gray-900">
-                    {companyData.competitors?.map((competitor, index) => (
-                      <li key={index}>{competitor}</li>
+                    {competitors.map((competitor, index) => (
+                      <li key={index}>
+                        {typeof competitor === "string"
+                          ? competitor
+                          : competitor.company_name}
+                      </li>
                     ))}
                   </ul>
                 </div>
@@ -1,22 +1,84 @@
-from langchain_core.runnables import chain
-from langgraph.graph import StateGraph, END
 from utils import (
     tavily_search,
-    load_and_chunk_data,
-    create_vectorstore,
-    retrieve_context,
+    load_and_index_urls,
+    pack_contexts,
+    unique_urls,
     extract_domain_info,
+    extract_domains_info,
     extract_competitor_info,
-    FastEmbedEmbeddings,
+    EXTRACTION_MODE,
+    get_embeddings,
 )
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass, field
+from typing import Annotated, Optional
+from result_store import DomainResultStore, EntityStore, entity_key, source_fingerprint
+import deadlines
+import enrichment
+import functools
+import metrics
+import os
+import threading
 import yaml
 
+# Maximum number of research nodes allowed to run at the same time
+MAX_CONCURRENCY = int(os.getenv("RESEARCH_MAX_CONCURRENCY", "7"))
+
+DOMAINS = ["finance", "markets", "audience", "paralegal", "political", "general"]
+
+# Completion status of each domain, returned with the results under "status"
+COMPLETE = "complete"  # Researched in this run
+FRESH = "fresh"  # Still-fresh results reused from the domain store
+NO_SOURCES = "no_sources"  # No pages were found or fetched for the domain
+FAILED = "failed"  # Extraction failed
+TIMEOUT = "timeout"  # Not finished before the run's deadline or the stage timeout
+SKIPPED = "skipped"  # Not researched because the company doesn't seem to exist
+
+# Per-company, per-domain results used to skip domains that are still fresh; opened on first use
+_domain_store = None
+_entity_store = None
+_graph = None
+_build_lock = threading.Lock()
+
+
+def get_domain_store() -> DomainResultStore:
+    """Returns the shared domain result store, opening it on first use."""
+    global _domain_store
+    if _domain_store is None:
+        with _build_lock:
+            if _domain_store is None:
+                _domain_store = DomainResultStore()
+    return _domain_store
+
+
+def get_entity_store() -> EntityStore:
+    """Returns the shared store of company profiles, opening it on first use."""
+    global _entity_store
+    if _entity_store is None:
+        with _build_lock:
+            if _entity_store is None:
+                _entity_store = EntityStore()
+    return _entity_store
+
+
+def merge_results(left: dict, right: dict) -> dict:
+    """Merges the partial results returned by nodes running in parallel."""
+    return {**(left or {}), **(right or {})}
+
+
 # Define the state of the graph using dataclasses for type safety
 @dataclass
 class AgentState:
     company_name: str
-    results: dict = field(default_factory=dict)
+    results: Annotated[dict, merge_results] = field(default_factory=dict)
+    contexts: dict = field(default_factory=dict)  # Retrieved context per domain, filled by gather_sources
+    fingerprints: dict = field(default_factory=dict)  # Fingerprint of the run's source URLs, per domain
+    searches: dict = field(default_factory=dict)  # Search results already fetched, by query name
+    sources: dict = field(default_factory=dict)  # URLs of the chunks in each domain's context
+    refresh: bool = False  # Re-research every domain, even if its stored results are fresh
+    enrich: bool = True  # Queue background research of competitors that have no fresh profile
+    deadline: Optional[float] = None  # time.time() by which the run must finish, see deadlines.deadline_at
+    status: Annotated[dict, merge_results] = field(default_factory=dict)  # Completion status per domain
 
     def __repr__(self):
         return f"AgentState(company_name={self.company_name}, results={self.results.keys() if self.results else None})"
@@ -25,204 +87,254 @@ class AgentState:
 # Define nodes (functions) in the graph
 def check_company_exists(state: AgentState):
     company_name = state.company_name
-    search_results = tavily_search(f"Is {company_name} a real company?")
+    try:
+        search_results = tavily_search(f"Is {company_name} a real company?")
+    except TimeoutError as e:
+        # Unknown rather than False, so format_results reports the domains as timed out, not skipped
+        print(f"Timed out checking whether {company_name} exists: {e}")
+        return {"results": {"exists": None}}
     exists = bool(search_results)
-    state.results["exists"] = exists
-    return {"exists": exists}
+    # Kept so gather_sources can reuse these pages instead of throwing them away
+    return {"results": {"exists": exists}, "searches": {"exists": search_results}}
+
+
+def route_existing_company(state: AgentState):
+    """Skips every other search and fetch when the company doesn't seem to exist."""
+    return "gather_sources" if state.results.get("exists") else "format_results"
+
+
+def research_queries(company_name: str) -> dict:
+    """Returns the search query used for each domain and for competitors."""
+    queries = {domain: f"{company_name} {domain} analysis" for domain in DOMAINS}
+    queries["competitors"] = f"{company_name} competitors"
+    return queries
+
+
+def gather_sources(state: AgentState):
+    """Searches every domain, fetches all result pages and retrieves each domain's context.
+
+    All of a company's searches run together, and the pages they return (including those
+    found by check_exists) are unioned and deduplicated, so every page is fetched once
+    and a domain can use any page, not just those its own query found. Pages are
+    chunked, deduped and embedded as they arrive, within the run's memory limit. Since any
+    page may feed any domain, each domain's fingerprint covers the whole union; domains
+    whose stored results are still fresh and whose fingerprint hasn't changed are filled
+    from the domain store and skipped. Each stale domain's context is packed from one vector
+    index per run by maximal marginal relevance up to the token budget, along with its
+    source URLs.
+    """
+    queries = research_queries(state.company_name)
+    with ThreadPoolExecutor(max_workers=min(len(queries), MAX_CONCURRENCY)) as pool:
+        futures = {domain: metrics.submit(pool, tavily_search, query) for domain, query in queries.items()}
+        searches, timed_out = {}, {}
+        for domain, future in futures.items():
+            try:
+                searches[domain] = future.result()
+            except TimeoutError as e:
+                print(f"Timed out searching for domain: {domain}: {e}")
+                timed_out[domain] = [] if domain == "competitors" else {}
+
+    # Domains whose search timed out are filled in empty, so no research node runs for them
+    queries = {domain: query for domain, query in queries.items() if domain not in timed_out}
+    domain_urls = {}
+    for domain, search_results in searches.items():
+        if not search_results:
+            print(f"No search results found for domain: {domain}")
+        domain_urls[domain] = [result.get('url') for result in search_results if result.get('url')]
+    found = [result.get('url') for result in state.searches.get("exists", []) if result.get('url')]
+    urls = unique_urls([url for urls in domain_urls.values() for url in urls] + found)
+    # A domain's context may come from any of these pages, so a change to any of them makes it stale
+    fingerprint = source_fingerprint(urls)
+    fingerprints = {domain: fingerprint for domain in domain_urls}
+
+    fresh = {} if state.refresh else get_domain_store().fresh_results(state.company_name, fingerprints)
+    status = {**{domain: FRESH for domain in fresh}, **{domain: TIMEOUT for domain in timed_out}}
+    filled = {**fresh, **timed_out}
+    stale_queries = {domain: query for domain, query in queries.items() if domain not in filled}
+    if not stale_queries:
+        return {"results": filled, "status": status, "fingerprints": fingerprints}
+
+    # Streamed into an index of each query's retrieval candidates, so the run never holds every chunk at once
+    db = load_and_index_urls(urls, stale_queries, get_embeddings())  # Shared warm model with a text-hash cache
+    packed = pack_contexts(db, stale_queries)
+    return {
+        "results": filled,
+        "status": status,
+        "contexts": {domain: entry["context"] for domain, entry in packed.items()},
+        "sources": {domain: entry["sources"] for domain, entry in packed.items()},
+        "fingerprints": fingerprints,
+    }
 
 
-def research_finance(state: AgentState):
-    company_name = state.company_name
-    domain = "finance"
-    search_query = f"{company_name} {domain} analysis"
-    search_results = tavily_search(search_query)
-
-    if not search_results:
-        print(f"No search results found for domain: {domain}")
-        return {"finance": {}}
-
-    embeddings = FastEmbedEmbeddings()
-    all_chunks = []
-    for result in search_results:
-        url = result.get('url')
-        if url:
-            chunks = load_and_chunk_data(url)
-            all_chunks.extend(chunks)
-
-    db = create_vectorstore(all_chunks, embeddings)
-    context = retrieve_context(db, search_query)
-    if not context:
-        return {"finance": {}}
+def route_stale_domains(state: AgentState):
+    """Sends the run to the research nodes whose domain wasn't filled from the store.
 
-    domain_info = extract_domain_info(company_name, domain, context)
-    state.results["finance"] = domain_info
-    return {"finance": domain_info}
+    With EXTRACTION_MODE=combined, every stale domain but competitors goes to research_domains instead.
+    """
+    stale_nodes = [node for node, domain in RESEARCH_NODES.items() if domain not in state.results]
+    if EXTRACTION_MODE == "combined":
+        combined = [node for node in stale_nodes if RESEARCH_NODES[node] in DOMAINS]
+        stale_nodes = [node for node in stale_nodes if node not in combined] + (["research_domains"] if combined else [])
+    return stale_nodes or ["format_results"]
 
 
-def research_markets(state: AgentState):
-    company_name = state.company_name
-    domain = "markets"
-    search_query = f"{company_name} {domain} analysis"
-    search_results = tavily_search(search_query)
-
-    if not search_results:
-        print(f"No search results found for domain: {domain}")
-        return {"markets": {}}
-
-    embeddings = FastEmbedEmbeddings()
-    all_chunks = []
-    for result in search_results:
-        url = result.get('url')
-        if url:
-            chunks = load_and_chunk_data(url)
-            all_chunks.extend(chunks)
-
-    db = create_vectorstore(all_chunks, embeddings)
-    context = retrieve_context(db, search_query)
-    if not context:
-        return {"markets": {}}
+def save_domain(state: AgentState, domain: str, data):
+    """Stores a freshly researched domain together with the fingerprint of its sources."""
+    if data:
+        get_domain_store().save(state.company_name, domain, data, state.fingerprints.get(domain))
 
-    domain_info = extract_domain_info(company_name, domain, context)
-    state.results["markets"] = domain_info
-    return {"markets": domain_info}
 
+def source_links(llm_links, sources: list) -> list:
+    """Returns the domain's news links: the sources the LLM cited first, then the other sources.
 
-def research_audience(state: AgentState):
-    company_name = state.company_name
-    domain = "audience"
-    search_query = f"{company_name} {domain} analysis"
-    search_results = tavily_search(search_query)
-
-    if not search_results:
-        print(f"No search results found for domain: {domain}")
-        return {"audience": {}}
-
-    embeddings = FastEmbedEmbeddings()
-    all_chunks = []
-    for result in search_results:
-        url = result.get('url')
-        if url:
-            chunks = load_and_chunk_data(url)
-            all_chunks.extend(chunks)
-
-    db = create_vectorstore(all_chunks, embeddings)
-    context = retrieve_context(db, search_query)
+    Links the LLM returns that aren't among the context's sources are dropped, since
+    they can't have come from the context.
+    """
+    cited = [link for link in (llm_links or []) if link in sources]
+    return list(dict.fromkeys(cited + sources))
+
+
+def unfinished(domain: str, context, empty):
+    """Returns the node output for a domain that can't be researched, or None if it can."""
+    if deadlines.expired():
+        return {"results": {domain: empty}, "status": {domain: TIMEOUT}}
     if not context:
-        return {"audience": {}}
+        return {"results": {domain: empty}, "status": {domain: NO_SOURCES}}
+    return None
+
+
+def research_domain(state: AgentState, domain: str):
+    """Extracts the structured information for a single domain from its context."""
+    context = state.contexts.get(domain)
+    skipped = unfinished(domain, context, {})
+    if skipped:
+        return skipped
+
+    try:
+        domain_info = extract_domain_info(state.company_name, domain, context)
+    except TimeoutError as e:
+        print(f"Timed out extracting {domain} information: {e}")
+        return {"results": {domain: {}}, "status": {domain: TIMEOUT}}
+    return finish_domain(state, domain, domain_info)
+
+
+def finish_domain(state: AgentState, domain: str, domain_info: dict):
+    """Links a domain's extracted information to its sources, stores it and returns the node output."""
+    if domain_info:
+        domain_info["news_links"] = source_links(domain_info.get("news_links"), state.sources.get(domain, []))
+    save_domain(state, domain, domain_info)
+    return {"results": {domain: domain_info}, "status": {domain: COMPLETE if domain_info else FAILED}}
+
+
+def research_domains(state: AgentState):
+    """Extracts every stale domain (except competitors) with one combined LLM call.
+
+    Used with EXTRACTION_MODE=combined. Domains the combined reply has no valid entry
+    for are extracted again with a research_domain call each.
+    """
+    outputs = []
+    contexts = {}
+    for domain in DOMAINS:
+        if domain in state.results:
+            continue
+        skipped = unfinished(domain, state.contexts.get(domain), {})
+        if skipped:
+            outputs.append(skipped)
+        else:
+            contexts[domain] = state.contexts[domain]
+
+    extracted = {}
+    if contexts:
+        try:
+            extracted = extract_domains_info(state.company_name, contexts)
+        except TimeoutError as e:
+            print(f"Timed out extracting combined domain information: {e}")
+            outputs.append({"results": {domain: {} for domain in contexts}, "status": {domain: TIMEOUT for domain in contexts}})
+            contexts = {}
+    outputs.extend(finish_domain(state, domain, info) for domain, info in extracted.items())
+
+    fallback = [domain for domain in contexts if domain not in extracted]
+    if fallback:
+        metrics.inc("research_extraction_fallbacks_total", len(fallback))
+        with ThreadPoolExecutor(max_workers=min(len(fallback), MAX_CONCURRENCY)) as pool:
+            futures = [metrics.submit(pool, research_domain, state, domain) for domain in fallback]
+            outputs.extend(future.result() for future in futures)
+
+    results, status = {}, {}
+    for output in outputs:
+        results.update(output["results"])
+        status.update(output["status"])
+    return {"results": results, "status": status}
 
-    domain_info = extract_domain_info(company_name, domain, context)
-    state.results["audience"] = domain_info
-    return {"audience": domain_info}
 
+def research_finance(state: AgentState):
+    return research_domain(state, "finance")
 
-def research_paralegal(state: AgentState):
-    company_name = state.company_name
-    domain = "paralegal"
-    search_query = f"{company_name} {domain} analysis"
-    search_results = tavily_search(search_query)
-
-    if not search_results:
-        print(f"No search results found for domain: {domain}")
-        return {"paralegal": {}}
-
-    embeddings = FastEmbedEmbeddings()
-    all_chunks = []
-    for result in search_results:
-        url = result.get('url')
-        if url:
-            chunks = load_and_chunk_data(url)
-            all_chunks.extend(chunks)
-
-    db = create_vectorstore(all_chunks, embeddings)
-    context = retrieve_context(db, search_query)
-    if not context:
-        return {"paralegal": {}}
 
-    domain_info = extract_domain_info(company_name, domain, context)
-    state.results["paralegal"] = domain_info
-    return {"paralegal": domain_info}
+def research_markets(state: AgentState):
+    return research_domain(state, "markets")
+
 
+def research_audience(state: AgentState):
+    return research_domain(state, "audience")
 
-def research_political(state: AgentState):
-    company_name = state.company_name
-    domain = "political"
-    search_query = f"{company_name} {domain} analysis"
-    search_results = tavily_search(search_query)
-
-    if not search_results:
-        print(f"No search results found for domain: {domain}")
-        return {"political": {}}
-
-    embeddings = FastEmbedEmbeddings()
-    all_chunks = []
-    for result in search_results:
-        url = result.get('url')
-        if url:
-            chunks = load_and_chunk_data(url)
-            all_chunks.extend(chunks)
-
-    db = create_vectorstore(all_chunks, embeddings)
-    context = retrieve_context(db, search_query)
-    if not context:
-        return {"political": {}}
 
-    domain_info = extract_domain_info(company_name, domain, context)
-    state.results["political"] = domain_info
-    return {"political": domain_info}
+def research_paralegal(state: AgentState):
+    return research_domain(state, "paralegal")
 
 
-def research_general(state: AgentState):
-    company_name = state.company_name
-    domain = "general"
-    search_query = f"{company_name} {domain} analysis"
-    search_results = tavily_search(search_query)
-
-    if not search_results:
-        print(f"No search results found for domain: {domain}")
-        return {"general": {}}
-
-    embeddings = FastEmbedEmbeddings()
-    all_chunks = []
-    for result in search_results:
-        url = result.get('url')
-        if url:
-            chunks = load_and_chunk_data(url)
-            all_chunks.extend(chunks)
-
-    db = create_vectorstore(all_chunks, embeddings)
-    context = retrieve_context(db, search_query)
-    if not context:
-        return {"general": {}}
+def research_political(state: AgentState):
+    return research_domain(state, "political")
 
-    domain_info = extract_domain_info(company_name, domain, context)
-    state.results["general"] = domain_info
-    return {"general": domain_info}
 
+def research_general(state: AgentState):
+    return research_domain(state, "general")
 
-def research_competitors(state: AgentState):
-    company_name = state.company_name
-    search_results = tavily_search(f"{company_name} competitors")
-
-    if not search_results:
-        print("No search results found for competitors.")
-        return {"competitors": []}
-
-    embeddings = FastEmbedEmbeddings()
-    all_chunks = []
-    for result in search_results:
-        url = result.get('url')
-        if url:
-            chunks = load_and_chunk_data(url)
-            all_chunks.extend(chunks)
-
-    db = create_vectorstore(all_chunks, embeddings)
-    context = retrieve_context(db, f"{company_name} competitors")
-    if not context:
-        return {"competitors": []}
 
-    competitor_info = extract_competitor_info(company_name, context)
-    state.results["competitors"] = competitor_info
-    return {"competitors": competitor_info}
+def research_competitors(state: AgentState):
+    context = state.contexts.get("competitors")
+    skipped = unfinished("competitors", context, [])
+    if skipped:
+        return skipped
+
+    try:
+        competitor_info = extract_competitor_info(state.company_name, context)
+    except TimeoutError as e:
+        print(f"Timed out extracting competitor information: {e}")
+        return {"results": {"competitors": []}, "status": {"competitors": TIMEOUT}}
+    competitor_info = fill_competitor_profiles(state, competitor_info)
+    save_domain(state, "competitors", competitor_info)
+    return {"results": {"competitors": competitor_info}, "status": {"competitors": COMPLETE if competitor_info else FAILED}}
+
+
+def fill_competitor_profiles(state: AgentState, competitors: list) -> list:
+    """Replaces competitor entries with the profiles of companies already researched, when fresh.
+
+    Competitors without a fresh profile keep their extracted entry and, unless the run
+    has enrich=False, are queued for background research so later runs can use them.
+    """
+    own_key = entity_key(state.company_name)
+    names = [c.get("company_name") for c in competitors if c.get("company_name") and entity_key(c["company_name"]) != own_key]
+    try:
+        profiles = get_entity_store().fresh_profiles(names)
+    except Exception as e:
+        print(f"Error loading competitor profiles: {e}")
+        profiles = {}
+
+    filled = []
+    for competitor in competitors:
+        name = competitor.get("company_name")
+        profile = profiles.get(name)
+        if profile:
+            metrics.record_cache("entity", hit=True)
+            filled.append({**competitor, **{k: v for k, v in profile.items() if v}, "company_name": name, "from_profile": True})
+            continue
+        if name in names:
+            metrics.record_cache("entity", hit=False)
+            if state.enrich:
+                enrichment.enrich_company(name)
+        filled.append(competitor)
+    return filled
 
 
 def format_results(state: AgentState):
@@ -239,42 +351,87 @@ def format_results(state: AgentState):
             "general": state.results.get("general", {}),
         },
         "competitors": state.results.get("competitors", []),
+        # Every domain gets a status, so clients can tell finished domains from missing ones
+        "status": {
+            domain: state.status.get(domain, SKIPPED if state.results.get("exists") is False else TIMEOUT)
+            for domain in RESEARCH_NODES.values()
+        },
     }
     return formatted_results
 
 
-# Define the graph
-builder = StateGraph(AgentState)
-builder.add_node("check_exists", check_company_exists)
-builder.add_node("research_finance", research_finance)
-builder.add_node("research_markets", research_markets)
-builder.add_node("research_audience", research_audience)
-builder.add_node("research_paralegal", research_paralegal)
-builder.add_node("research_political", research_political)
-builder.add_node("research_general", research_general)
-builder.add_node("research_competitors", research_competitors)
-builder.add_node("format_results", format_results)
+# Research node name -> the domain it fills in
+RESEARCH_NODES = {f"research_{domain}": domain for domain in DOMAINS}
+RESEARCH_NODES["research_competitors"] = "competitors"
+
+
+def graph_node(name: str, fn):
+    """Wraps a node so it runs under its run's deadline and its latency is recorded."""
+    @functools.wraps(fn)
+    def node(state: AgentState):
+        with deadlines.until(state.deadline):
+            return fn(state)
+    return metrics.timed_node(name, node)
+
+
+def build_graph():
+    """Builds and compiles the research graph."""
+    from langgraph.graph import StateGraph, END  # langgraph is slow to import
+
+    builder = StateGraph(AgentState)
+    builder.add_node("check_exists", graph_node("check_exists", check_company_exists))
+    builder.add_node("gather_sources", graph_node("gather_sources", gather_sources))
+    builder.add_node("research_finance", graph_node("research_finance", research_finance))
+    builder.add_node("research_markets", graph_node("research_markets", research_markets))
+    builder.add_node("research_audience", graph_node("research_audience", research_audience))
+    builder.add_node("research_paralegal", graph_node("research_paralegal", research_paralegal))
+    builder.add_node("research_political", graph_node("research_political", research_political))
+    builder.add_node("research_general", graph_node("research_general", research_general))
+    builder.add_node("research_competitors", graph_node("research_competitors", research_competitors))
+    builder.add_node("research_domains", graph_node("research_domains", research_domains))
+    builder.add_node("format_results", graph_node("format_results", format_results))
+
+    # Define edges: stop early if the company doesn't exist, otherwise gather every domain's
+    # sources once, fan out to the research nodes whose domain is stale, then join all of
+    # them into format_results.
+    builder.add_conditional_edges("check_exists", route_existing_company, ["gather_sources", "format_results"])
+    builder.add_conditional_edges(
+        "gather_sources", route_stale_domains, [*RESEARCH_NODES, "research_domains", "format_results"]
+    )
+    for node in [*RESEARCH_NODES, "research_domains"]:
+        builder.add_edge(node, "format_results")  # Runs once, after every research node in the step
+    builder.add_edge("format_results", END)
+
+    builder.set_entry_point("check_exists")
+
+    return builder.compile()
+
+
+def get_graph():
+    """Returns the compiled research graph, building it on first use."""
+    global _graph
+    if _graph is None:
+        with _build_lock:
+            if _graph is None:
+                _graph = build_graph()
+    return _graph
+
 
-# Define edges
-builder.add_edge("check_exists", "research_finance")  # If company exists, start finance research
-builder.add_edge("research_finance", "research_markets")
-builder.add_edge("research_markets", "research_audience")
-builder.add_edge("research_audience", "research_paralegal")
-builder.add_edge("research_paralegal", "research_political")
-builder.add_edge("research_political", "research_general")
-builder.add_edge("research_general", "research_competitors")
-builder.add_edge("research_competitors", "format_results")  # Always format results.
-builder.add_edge("format_results", END)
+def __getattr__(name):
+    # Keeps `graph.graph` working without compiling the graph at import time
+    if name == "graph":
+        return get_graph()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
-builder.set_entry_point("check_exists")
 
-# Compile the graph
-graph = builder.compile()
+def invoke_config(max_concurrency: int = MAX_CONCURRENCY) -> dict:
+    """Returns the runnable config used to cap how many nodes run in parallel."""
+    return {"max_concurrency": max_concurrency}
 
 
 # Example usage
 if __name__ == "__main__":
     company_name = "OpenAI"
     initial_state = AgentState(company_name=company_name)
-    results = graph.invoke(initial_state)
-    print(yaml.dump(results["formatted_results"], indent=2))
\ No newline at end of file
+    results = get_graph().invoke(initial_state, config=invoke_config())
+    print(yaml.dump(results["results"], indent=2))
\ No newline at end of file
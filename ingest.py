@@ -0,0 +1,84 @@
+import os
+from typing import Iterable, List
+
+import deadlines
+import metrics
+from dedup import ChunkDeduper
+from embedding_cache import EMBED_BATCH_SIZE
+from fetcher import chunks_size
+
+# Ingestion settings, overridable through the environment. The fetcher's chunk cache, shared
+# by every run, is bounded separately by FETCH_CACHE_MAX_MB
+INGEST_MEMORY_LIMIT_MB = float(os.getenv("INGEST_MEMORY_LIMIT_MB", "256"))  # Per run; later pages are skipped, 0 no limit
+
+
+class Chunk:
+    """A chunk of page text and the URL it came from.
+
+    Stands in for a langchain Document, which carries a pydantic model and a metadata
+    dict per chunk; `metadata` is built on demand for code that expects one.
+    """
+
+    __slots__ = ("page_content", "source")
+
+    def __init__(self, page_content: str, source: str):
+        self.page_content = page_content
+        self.source = source
+
+    @property
+    def metadata(self) -> dict:
+        return {"source": self.source}
+
+    def __repr__(self) -> str:
+        return f"Chunk(source={self.source!r}, chars={len(self.page_content)})"
+
+
+def ingest(pages: Iterable[List[Chunk]], embeddings, queries: List[str], keep: int,
+           batch_size: int = EMBED_BATCH_SIZE, memory_limit_mb: float = INGEST_MEMORY_LIMIT_MB):
+    """Streams chunked pages through dedup and embedding into an index of retrieval candidates for `queries`.
+
+    Pages are consumed as they arrive and their new chunks embedded `batch_size` at a time.
+    After each batch only the `keep` chunks most similar to each query are kept (see
+    CandidatePool), so the text and vectors of every other chunk are released as soon as
+    they have been embedded. If the memory held by the run still passes `memory_limit_mb`,
+    the remaining pages are skipped. Returns a VectorIndex, or None if nothing was indexed.
+    """
+    from vector_index import CandidatePool, embed_documents, embed_queries
+
+    if not queries:
+        return None
+    pool = CandidatePool(embed_queries(embeddings, queries), keep)
+    deduper = ChunkDeduper()
+    limit = memory_limit_mb * 1024 * 1024
+    pending: List[Chunk] = []
+    pages_read = chunks_read = 0
+
+    def embed_pending(count: int):
+        batch = pending[:count]
+        del pending[:count]
+        if not batch:
+            return
+        with metrics.span("index_build", chunks=len(batch)):
+            pool.add(batch, deadlines.run_with_timeout("embed", embed_documents, embeddings, [c.page_content for c in batch]))
+
+    try:
+        for chunks in pages:
+            pages_read += 1
+            chunks_read += len(chunks)
+            pending.extend(deduper.add(chunks))
+            while len(pending) >= batch_size:
+                embed_pending(batch_size)
+            held = pool.nbytes() + deduper.nbytes() + chunks_size(pending)
+            if limit and held > limit:
+                metrics.inc("research_ingest_truncated_total")
+                print(f"Skipping remaining pages: ingestion holds {held / (1024 * 1024):.1f} MB "
+                      f"(INGEST_MEMORY_LIMIT_MB {memory_limit_mb:g}) after {pages_read} pages")
+                break
+        embed_pending(len(pending))
+    except TimeoutError as e:
+        metrics.record_error("index_build")
+        print(f"Indexing the first {chunks_read} chunks only: {e}")
+    finally:
+        deduper.record()
+    metrics.inc("research_chunks_indexed_total", len(pool))
+    return pool.to_index(embeddings) if len(pool) else None
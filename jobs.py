@@ -0,0 +1,113 @@
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Optional
+
+# Job settings, overridable through the environment
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+JOB_TTL = float(os.getenv("JOB_TTL", "3600"))  # Seconds a finished job is kept for polling
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+@dataclass
+class Job:
+    id: str
+    company_name: str
+    status: str = QUEUED
+    result: Optional[dict] = None
+    error: Optional[str] = None
+    created_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+
+    def to_dict(self, include_result: bool = True) -> dict:
+        data = {
+            "job_id": self.id,
+            "company_name": self.company_name,
+            "status": self.status,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+        if self.error:
+            data["error"] = self.error
+        if include_result and self.status == DONE:
+            data["result"] = self.result
+        return data
+
+
+def job_key(company_name: str) -> str:
+    """Normalizes a company name so identical requests map to the same job."""
+    return " ".join(company_name.lower().split())
+
+
+class JobManager:
+    """Runs research jobs on a bounded worker pool and tracks their status.
+
+    A request for a company that already has a queued or running job is attached
+    to that job instead of starting a new one.
+    """
+
+    def __init__(self, run: Callable[[str], dict], workers: int = JOB_WORKERS, ttl: float = JOB_TTL,
+                 max_active: Optional[int] = None):
+        self.run = run
+        self.ttl = ttl
+        self.max_active = max_active  # Queued plus running jobs allowed at once; None for no limit
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="research")
+        self._jobs: Dict[str, Job] = {}
+        self._active: Dict[str, str] = {}  # job_key -> id of the queued or running job
+        self._lock = threading.Lock()
+
+    def submit(self, company_name: str) -> Optional[Job]:
+        """Queues a job for the company, or returns its active job. Returns None if `max_active` jobs are active."""
+        key = job_key(company_name)
+        with self._lock:
+            self._purge()
+            job_id = self._active.get(key)
+            if job_id is not None:
+                return self._jobs[job_id]
+            if self.max_active is not None and len(self._active) >= self.max_active:
+                return None
+            job = Job(id=uuid.uuid4().hex, company_name=company_name)
+            self._jobs[job.id] = job
+            self._active[key] = job.id
+        self._executor.submit(self._execute, job, key)
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _execute(self, job: Job, key: str):
+        job.status = RUNNING
+        job.started_at = time.time()
+        try:
+            result = self.run(job.company_name)
+            if isinstance(result, dict) and "error" in result:
+                job.error = str(result["error"])
+                job.status = FAILED
+            else:
+                job.result = result
+                job.status = DONE
+        except Exception as e:
+            job.error = str(e)
+            job.status = FAILED
+        finally:
+            job.finished_at = time.time()
+            with self._lock:
+                if self._active.get(key) == job.id:
+                    del self._active[key]
+
+    def _purge(self):
+        """Drops finished jobs older than the TTL. Must be called with the lock held."""
+        cutoff = time.time() - self.ttl
+        expired = [job_id for job_id, job in self._jobs.items() if job.finished_at and job.finished_at < cutoff]
+        for job_id in expired:
+            del self._jobs[job_id]
@@ -0,0 +1,73 @@
+import os
+import threading
+from typing import Any, Callable
+
+from cache import LRUCache, SingleFlight, hash_key, open_store
+import metrics
+
+# LLM response cache settings, overridable through the environment
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", "604800"))
+LLM_CACHE_SIZE = int(os.getenv("LLM_CACHE_SIZE", "2048"))
+LLM_CACHE_STORE = os.getenv("LLM_CACHE_STORE", "memory")  # "memory", "disk" or "sqlite"
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH")
+
+
+class ExtractionCache:
+    """Caches parsed LLM outputs by model name and rendered prompt.
+
+    The LLM runs at temperature 0, so an extraction is a pure function of its prompt.
+    Parsed outputs are kept in a TTL-bounded LRU and, optionally, in a persistent store
+    shared between worker processes. Identical prompts in flight share one LLM call.
+    """
+
+    def __init__(self, model_name: str, cache_size: int = LLM_CACHE_SIZE, ttl: float = LLM_CACHE_TTL, store=None):
+        self.model_name = model_name
+        self.store = store
+        self.hits = 0
+        self.misses = 0
+        self._memory = LRUCache(cache_size, ttl=ttl)
+        self._inflight = SingleFlight()
+        self._lock = threading.Lock()
+
+    def key(self, prompt: str) -> str:
+        return hash_key("llm", self.model_name, prompt)
+
+    def _count(self, hit: bool):
+        metrics.record_cache("llm", hit=hit)
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def _compute(self, key: str, compute: Callable[[], Any]):
+        if self.store is not None:
+            output = self.store.get(key)
+            if output is not None:
+                self._count(hit=True)
+                self._memory.set(key, output)
+                return output
+        self._count(hit=False)
+        output = compute()
+        self._memory.set(key, output)
+        if self.store is not None:
+            self.store.set(key, output)
+        return output
+
+    def get_or_compute(self, prompt: str, compute: Callable[[], Any]):
+        """Returns the cached output for the prompt, calling `compute` on a miss."""
+        key = self.key(prompt)
+        output = self._memory.get(key)
+        if output is not None:
+            self._count(hit=True)
+            return output
+        return self._inflight.do(key, lambda: self._compute(key, compute))
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._memory)}
+
+
+def create_extraction_cache(model_name: str) -> ExtractionCache:
+    """Builds the extraction cache configured by the LLM_CACHE_* environment variables."""
+    store = open_store(LLM_CACHE_STORE, LLM_CACHE_PATH, ttl=LLM_CACHE_TTL, table="llm")
+    return ExtractionCache(model_name, store=store)
@@ -1,39 +1,234 @@
 import os
-import yaml
+import sys
+import json
 import logging
+import argparse
+import itertools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 from dotenv import load_dotenv
-from langgraph.graph import StateGraph, END
-from dataclasses import dataclass
-from utils import tavily_search, load_and_chunk_data, create_vectorstore, retrieve_context, extract_domain_info, extract_competitor_info
-from utils import FastEmbedEmbeddings
-from graph import graph, AgentState  # Import what we need from graph.py
+from graph import get_graph, get_entity_store, AgentState, invoke_config  # Import what we need from graph.py
+from jobs import job_key
+from result_store import ResearchResultStore, profile_from_results
+import deadlines
+import enrichment
+import ratelimit
 
-# Load environment variables
+# Load environment variables (utils checks the API keys it needs when its clients are first created)
 load_dotenv()
 
-tavily_api_key = os.getenv("TAVILY_API_KEY")
-groq_api_key = os.getenv("GROQ_API_KEY")
+# Maximum number of companies researched at the same time across all batches
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "4"))
+batch_executor = ThreadPoolExecutor(max_workers=BATCH_CONCURRENCY, thread_name_prefix="batch")
+
+# Every run is stored here; writes happen on a single background thread, off the request path
+_result_store = None
+_result_store_lock = threading.Lock()
+results_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="results-writer")
+
+
+def get_result_store() -> ResearchResultStore:
+    """Returns the shared result store, opening its database on first use."""
+    global _result_store
+    if _result_store is None:
+        with _result_store_lock:
+            if _result_store is None:
+                _result_store = ResearchResultStore()
+    return _result_store
+
+
+def warmup() -> dict:
+    """Creates every client and loads every heavy dependency up front, instead of on the first request.
+
+    Call it before the process accepts traffic. Returns the seconds each step took.
+    """
+    import utils
+
+    def embedding_model():
+        from embedding_cache import get_embedding_model
+        get_embedding_model().embed_query("warmup")  # Loads the model weights and runtime session
+
+    def parsers():
+        import langchain.text_splitter, langchain.prompts, langchain.output_parsers  # noqa: F401
+        try:
+            import unstructured.partition.html, unstructured.partition.pdf  # noqa: F401
+        except ImportError as e:
+            logging.warning(f"Unstructured partitioners not preloaded: {e}")
+
+    steps = [
+        ("api_keys", utils.check_api_keys),
+        ("graph", get_graph),
+        ("embedding_model", embedding_model),
+        ("search", utils.get_search),
+        ("llm", utils.get_llm),
+        ("extraction_cache", utils.get_extraction_cache),
+        ("extraction_prompts", utils.get_extraction_prompts),
+        ("fetcher", utils.get_fetcher),
+        ("parsers", parsers),
+        ("result_store", get_result_store),
+    ]
+    timings = {}
+    for name, step in steps:
+        start = time.perf_counter()
+        step()
+        timings[name] = time.perf_counter() - start
+    logging.info("Warmup done in %.2fs: %s", sum(timings.values()), timings)
+    return timings
 
-if not tavily_api_key or not groq_api_key:
-    raise ValueError("TAVILY_API_KEY and GROQ_API_KEY must be set in the .env file")
 
 # Function to run the agent with a given company name
-def run_agent(company_name: str):
-    # Initialize the agent state
-    initial_state = AgentState(company_name=company_name)
+def run_agent(company_name: str, save: bool = True, refresh: bool = False, enrich: bool = True):
+    # Initialize the agent state; refresh=True re-researches domains that are still fresh,
+    # enrich=False stops the run from queueing background research of its competitors
+    # Every node runs under the RUN_DEADLINE set here; domains not done by then come back marked "timeout"
+    initial_state = AgentState(company_name=company_name, refresh=refresh, enrich=enrich, deadline=deadlines.deadline_at())
     
     try:
         # Invoke the agent with the state and get the results
-        results = graph.invoke(initial_state)
-        research_results = results
+        # Research nodes run in parallel, capped by RESEARCH_MAX_CONCURRENCY
+        state = get_graph().invoke(initial_state, config=invoke_config())
+        research_results = research_output(company_name, state["results"], state["status"])
         
-        # Optionally, save the results to a YAML file (for debugging or further use)
-        with open("research_results.yaml", "w") as outfile:
-            yaml.dump(research_results, outfile, default_flow_style=False, indent=2)
-        
-        logging.info("Research complete. Results saved to research_results.yaml")
+        if save:
+            save_results(company_name, research_results)
         
         return research_results  # Return the results as a Python dictionary (can be converted to JSON)
     except Exception as e:
         logging.error(f"Error during research: {e}")
         return {"error": str(e)}  # Return an error message if the research fails
+
+
+def research_output(company_name: str, results: dict, status: dict) -> dict:
+    """Returns the body that is returned, stored and streamed for a run.
+
+    The rest of the graph state (packed contexts, raw search results, fingerprints, ...) stays internal.
+    """
+    return {"company_name": company_name, "results": results, "status": status}
+
+
+def save_results(company_name: str, research_results: dict):
+    """Queues the results to be stored in the result store, and the company's profile in the entity store."""
+    results_writer.submit(get_result_store().save, company_name, research_results)
+    profile = profile_from_results(company_name, research_results.get("results"))
+    if profile:
+        results_writer.submit(get_entity_store().save_profile, company_name, profile)
+    logging.info(f"Research complete. Results for {company_name} queued for the result store")
+
+
+def run_in_lane(priority: int, fn, *args, **kwargs):
+    """Runs `fn` with its Tavily and Groq calls queued in the given rate-limit lane."""
+    with ratelimit.lane(priority):
+        return fn(*args, **kwargs)
+
+
+# Background research of competitors found by interactive runs (see graph.fill_competitor_profiles)
+enrichment.configure(lambda company_name: run_in_lane(ratelimit.BATCH, run_agent, company_name, enrich=False))
+
+
+# Function to run the agent and yield each node's results as soon as it finishes
+def stream_agent(company_name: str, refresh: bool = False):
+    """Yields a "result" event per finished domain, then a "complete" event with everything.
+
+    Nodes that don't produce results (e.g. gather_sources) yield a "progress" event.
+    """
+    initial_state = AgentState(company_name=company_name, refresh=refresh, deadline=deadlines.deadline_at())
+    results = {}
+    status = {}
+
+    try:
+        for update in get_graph().stream(initial_state, config=invoke_config(), stream_mode="updates"):
+            for node, output in update.items():
+                status.update((output or {}).get("status") or {})
+                node_results = (output or {}).get("results")
+                if not node_results:
+                    yield {"event": "progress", "node": node}
+                    continue
+                for name, value in node_results.items():
+                    results[name] = value
+                    yield {"event": "result", "node": node, "name": name, "data": value, "status": status.get(name)}
+
+        research_results = research_output(company_name, results, status)
+        save_results(company_name, research_results)
+        yield {"event": "complete", "data": research_results}
+    except Exception as e:
+        logging.error(f"Error during research: {e}")
+        yield {"event": "error", "error": str(e)}
+
+
+# Function to research a list of companies, yielding each one's results as soon as it finishes
+def run_batch(company_names, max_pending: int = None):
+    """Researches many companies on the shared batch pool and yields (company_name, results).
+
+    Names are deduplicated case-insensitively and consumed lazily, and at most
+    `max_pending` companies are queued at once, so large watchlists never sit in
+    memory. Search, fetch, embedding and LLM caches are shared by every company in
+    the batch, so overlapping competitors are only researched once. Every company's
+    results and profile are stored, so a watchlist company that is another's
+    competitor is filled from its profile. Batch runs wait behind interactive
+    requests for Tavily and Groq quota.
+    """
+    max_pending = max_pending or 2 * BATCH_CONCURRENCY
+    names = iter(company_names)
+    seen = set()
+    pending = {}
+
+    def submit_next():
+        for name in names:
+            name = name.strip()
+            key = job_key(name)
+            if not key or key in seen:
+                continue
+            seen.add(key)
+            # Batch runs don't queue background research; the watchlist is what should be researched
+            pending[batch_executor.submit(run_in_lane, ratelimit.BATCH, run_agent, name, enrich=False)] = name
+            return True
+        return False
+
+    while len(pending) < max_pending and submit_next():
+        pass
+
+    while pending:
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            name = pending.pop(future)
+            yield name, future.result()
+            submit_next()
+
+
+def write_batch(company_names, outfile) -> int:
+    """Writes one JSON line per researched company to `outfile` as results come in."""
+    count = 0
+    for name, research_results in run_batch(company_names):
+        outfile.write(json.dumps({"company_name": name, **research_results}, default=str) + "\n")
+        outfile.flush()
+        count += 1
+    return count
+
+
+def read_company_names(path: str):
+    """Yields the company names in a file, one per line, skipping blanks and # comments."""
+    with open(path, encoding="utf-8") as infile:
+        for line in infile:
+            line = line.strip()
+            if line and not line.startswith("#"):
+                yield line
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Research one or more companies.")
+    parser.add_argument("companies", nargs="*", help="Company names to research")
+    parser.add_argument("--file", help="File with one company name per line")
+    parser.add_argument("--output", help="File to write JSON lines to (defaults to stdout)")
+    args = parser.parse_args()
+
+    if not args.companies and not args.file:
+        parser.error("Provide company names or --file")
+    company_names = itertools.chain(args.companies, read_company_names(args.file) if args.file else [])
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as outfile:
+            total = write_batch(company_names, outfile)
+    else:
+        total = write_batch(company_names, sys.stdout)
+    logging.info(f"Researched {total} companies")
@@ -0,0 +1,160 @@
+import contextvars
+import functools
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+# Histogram buckets in seconds, from a cache hit up to a slow LLM call or PDF parse
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+# name -> (type, help text)
+METRICS = {
+    "research_stage_seconds": ("histogram", "Latency of each pipeline stage in seconds"),
+    "research_node_seconds": ("histogram", "Latency of each graph node in seconds"),
+    "research_bytes_fetched_total": ("counter", "Bytes downloaded from result pages"),
+    "research_chunks_produced_total": ("counter", "Chunks produced by splitting fetched pages"),
+    "research_pages_parsed_total": ("counter", "Fetched pages parsed, by detected kind and parser used"),
+    "research_chunks_dropped_total": ("counter", "Chunks dropped before embedding, by reason"),
+    "research_chunks_indexed_total": ("counter", "Chunks kept in a run's index as retrieval candidates"),
+    "research_ingest_truncated_total": ("counter", "Runs whose remaining pages were skipped at the ingestion memory limit"),
+    "research_llm_tokens_total": ("counter", "LLM tokens sent and received"),
+    "research_extraction_fallbacks_total": ("counter", "Domains re-extracted alone after a combined extraction gave no valid entry"),
+    "research_cache_requests_total": ("counter", "Cache lookups by cache and result"),
+    "research_errors_total": ("counter", "Errors caught in each pipeline stage"),
+    "research_timeouts_total": ("counter", "Calls and pages abandoned after their stage timeout or the run deadline"),
+    "research_hedged_fetches_total": ("counter", "Duplicate page requests sent for slow fetches, by which request won"),
+    "research_retries_total": ("counter", "Provider calls retried after a rate-limit, server or connection error"),
+    "research_ratelimit_wait_seconds": ("histogram", "Time calls waited for provider quota, by lane"),
+    "research_ratelimit_queue_depth": ("gauge", "Calls waiting for provider quota, by lane"),
+    "research_ratelimit_abandoned_total": ("counter", "Calls that left the quota queue when their deadline passed"),
+}
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+_lock = threading.Lock()
+_counters: Dict[str, Dict[LabelKey, float]] = {}
+_gauges: Dict[str, Dict[LabelKey, float]] = {}
+_histograms: Dict[str, Dict[LabelKey, list]] = {}  # label key -> [bucket counts..., sum, count]
+
+# Spans recorded for the current request when tracing is on, see trace()
+_current_trace: contextvars.ContextVar[Optional[List[dict]]] = contextvars.ContextVar("trace", default=None)
+
+
+def _label_key(labels: dict) -> LabelKey:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def inc(name: str, value: float = 1, **labels):
+    """Adds `value` to a counter."""
+    key = _label_key(labels)
+    with _lock:
+        series = _counters.setdefault(name, {})
+        series[key] = series.get(key, 0) + value
+
+
+def set_gauge(name: str, value: float, **labels):
+    """Sets a gauge to `value`."""
+    key = _label_key(labels)
+    with _lock:
+        _gauges.setdefault(name, {})[key] = value
+
+
+def observe(name: str, value: float, **labels):
+    """Records one observation in a histogram."""
+    key = _label_key(labels)
+    with _lock:
+        series = _histograms.setdefault(name, {})
+        state = series.get(key)
+        if state is None:
+            state = series[key] = [0] * len(LATENCY_BUCKETS) + [0.0, 0]
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if value <= bound:
+                state[i] += 1
+        state[-2] += value
+        state[-1] += 1
+
+
+def record_cache(cache: str, hit: bool, count: int = 1):
+    """Counts cache lookups for the given cache."""
+    if count:
+        inc("research_cache_requests_total", count, cache=cache, result="hit" if hit else "miss")
+
+
+def record_error(stage: str):
+    inc("research_errors_total", stage=stage)
+
+
+@contextmanager
+def span(stage: str, **labels):
+    """Times a pipeline stage into research_stage_seconds and the current trace, if any."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        observe("research_stage_seconds", elapsed, stage=stage)
+        spans = _current_trace.get()
+        if spans is not None:
+            spans.append({"stage": stage, "seconds": round(elapsed, 4), **labels})
+
+
+def timed_node(name: str, fn):
+    """Wraps a graph node so its latency is recorded in research_node_seconds."""
+    @functools.wraps(fn)
+    def wrapper(state):
+        start = time.perf_counter()
+        try:
+            return fn(state)
+        finally:
+            elapsed = time.perf_counter() - start
+            observe("research_node_seconds", elapsed, node=name)
+            spans = _current_trace.get()
+            if spans is not None:
+                spans.append({"node": name, "seconds": round(elapsed, 4)})
+    return wrapper
+
+
+@contextmanager
+def trace():
+    """Collects the spans of everything run inside the block (including worker threads
+    started with a copy of the current context) and yields the list they go into."""
+    spans: List[dict] = []
+    token = _current_trace.set(spans)
+    try:
+        yield spans
+    finally:
+        _current_trace.reset(token)
+
+
+def submit(executor, fn, *args):
+    """Submits `fn` to an executor in a copy of the current context, so spans reach the trace."""
+    return executor.submit(contextvars.copy_context().run, fn, *args)
+
+
+def _format_labels(key: LabelKey, extra: Tuple[Tuple[str, str], ...] = ()) -> str:
+    pairs = key + extra
+    if not pairs:
+        return ""
+    escaped = (value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+def render_prometheus() -> str:
+    """Renders every metric in the Prometheus text exposition format."""
+    lines = []
+    with _lock:
+        for name, (kind, help_text) in METRICS.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            if kind in ("counter", "gauge"):
+                for key, value in (_counters if kind == "counter" else _gauges).get(name, {}).items():
+                    lines.append(f"{name}{_format_labels(key)} {value}")
+                continue
+            for key, state in _histograms.get(name, {}).items():
+                for bound, count in zip(LATENCY_BUCKETS, state):
+                    lines.append(f"{name}_bucket{_format_labels(key, (('le', str(bound)),))} {count}")
+                lines.append(f"{name}_bucket{_format_labels(key, (('le', '+Inf'),))} {state[-1]}")
+                lines.append(f"{name}_sum{_format_labels(key)} {state[-2]}")
+                lines.append(f"{name}_count{_format_labels(key)} {state[-1]}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,216 @@
+import contextvars
+import heapq
+import itertools
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Optional
+
+import deadlines
+import metrics
+
+# Provider quotas, overridable through the environment; 0 means unlimited
+TAVILY_RPS = float(os.getenv("TAVILY_RPS", "5"))  # Search requests per second
+GROQ_RPM = float(os.getenv("GROQ_RPM", "30"))  # Chat requests per minute
+GROQ_TPM = float(os.getenv("GROQ_TPM", "30000"))  # Prompt plus completion tokens per minute
+GROQ_COMPLETION_TOKENS = int(os.getenv("GROQ_COMPLETION_TOKENS", "400"))  # Reserved per call until usage is known
+
+# Retry settings for rate-limited (429), server (5xx) and connection errors
+RETRY_ATTEMPTS = int(os.getenv("RETRY_ATTEMPTS", "5"))
+RETRY_BASE_DELAY = float(os.getenv("RETRY_BASE_DELAY", "0.5"))
+RETRY_MAX_DELAY = float(os.getenv("RETRY_MAX_DELAY", "30"))
+
+# Priority lanes; a lower number is served first when callers are waiting for quota
+INTERACTIVE = 0
+BATCH = 1
+LANE_NAMES = {INTERACTIVE: "interactive", BATCH: "batch"}
+
+_current_lane: contextvars.ContextVar[int] = contextvars.ContextVar("lane", default=INTERACTIVE)
+
+
+@contextmanager
+def lane(priority: int):
+    """Runs the block (and worker threads started with a copy of its context) in the given lane."""
+    token = _current_lane.set(priority)
+    try:
+        yield
+    finally:
+        _current_lane.reset(token)
+
+
+class TokenBucket:
+    """Process-wide token bucket for one provider quota, served in priority order.
+
+    Waiting callers queue by (lane, arrival); only the head of the queue may take
+    tokens, so interactive calls overtake queued batch calls but nobody starves
+    within a lane. Tokens can go negative when a call turns out to cost more than
+    estimated (see adjust), which delays the calls after it.
+    """
+
+    def __init__(self, provider: str, unit: str, rate: float, capacity: Optional[float] = None):
+        self.provider = provider
+        self.unit = unit
+        self.rate = rate  # Tokens added per second
+        self.capacity = capacity if capacity is not None else max(rate, 1.0)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._waiting = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+
+    def _refill(self, now: float):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def _record_depth(self):
+        for priority, name in LANE_NAMES.items():
+            depth = sum(1 for ticket in self._waiting if ticket[0] == priority)
+            metrics.set_gauge("research_ratelimit_queue_depth", depth, provider=self.provider, unit=self.unit, lane=name)
+
+    def acquire(self, amount: float = 1, priority: Optional[int] = None) -> float:
+        """Blocks until `amount` tokens are available and takes them. Returns the seconds waited.
+
+        Waits no longer than the current run's deadline allows: once that passes, the
+        caller leaves the queue without tokens and TimeoutError is raised.
+        """
+        if self.rate <= 0:
+            return 0.0
+        amount = min(amount, self.capacity)  # A call bigger than the bucket would otherwise wait forever
+        ticket = (_current_lane.get() if priority is None else priority, next(self._seq))
+        start = time.monotonic()
+        left = deadlines.remaining()
+        give_up = None if left is None else start + left
+        with self._cond:
+            heapq.heappush(self._waiting, ticket)
+            self._record_depth()
+            try:
+                while True:
+                    now = time.monotonic()
+                    self._refill(now)
+                    if self._waiting[0] == ticket and now >= self._paused_until and self._tokens >= amount:
+                        self._tokens -= amount
+                        break
+                    if give_up is not None and now >= give_up:
+                        metrics.inc("research_ratelimit_abandoned_total", provider=self.provider, unit=self.unit)
+                        raise TimeoutError(f"deadline passed while waiting for {self.provider} {self.unit} quota")
+                    if self._waiting[0] != ticket:
+                        wait = None  # Woken when the head of the queue changes
+                    else:
+                        wait = max(self._paused_until - now, (amount - self._tokens) / self.rate, 0.001)
+                    if give_up is not None:
+                        wait = give_up - now if wait is None else min(wait, give_up - now)
+                    self._cond.wait(wait)
+            finally:
+                self._waiting.remove(ticket)
+                heapq.heapify(self._waiting)
+                self._record_depth()
+                self._cond.notify_all()
+        waited = time.monotonic() - start
+        metrics.observe("research_ratelimit_wait_seconds", waited, provider=self.provider, lane=LANE_NAMES[ticket[0]])
+        return waited
+
+    def adjust(self, amount: float):
+        """Charges (or refunds, if negative) tokens after the fact."""
+        if self.rate <= 0:
+            return
+        with self._cond:
+            self._refill(time.monotonic())
+            self._tokens -= amount
+            self._cond.notify_all()
+
+    def pause(self, seconds: float):
+        """Stops handing out tokens for `seconds`, e.g. after the provider answered 429."""
+        with self._cond:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+
+# provider -> {unit: bucket}. Groq limits both requests and tokens per minute
+BUCKETS: Dict[str, Dict[str, TokenBucket]] = {
+    "tavily": {"requests": TokenBucket("tavily", "requests", TAVILY_RPS, capacity=max(TAVILY_RPS, 1.0))},
+    "groq": {
+        "requests": TokenBucket("groq", "requests", GROQ_RPM / 60, capacity=max(GROQ_RPM / 6, 1.0)),
+        "tokens": TokenBucket("groq", "tokens", GROQ_TPM / 60, capacity=GROQ_TPM / 6 or None),
+    },
+}
+
+
+def status_code(error: Exception) -> Optional[int]:
+    """Returns the HTTP status behind an API client error, if it has one."""
+    for source in (error, getattr(error, "response", None)):
+        code = getattr(source, "status_code", None)
+        if isinstance(code, int):
+            return code
+    if type(error).__name__ in ("RateLimitError", "UsageLimitExceededError"):
+        return 429
+    return None
+
+
+def is_retryable(error: Exception) -> bool:
+    code = status_code(error)
+    if code is not None:
+        return code == 429 or code >= 500
+    return any(word in type(error).__name__ for word in ("Timeout", "Connection"))
+
+
+def retry_after(error: Exception) -> Optional[float]:
+    """Returns the delay the provider asked for in a Retry-After header, if any."""
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after") or headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt: int) -> float:
+    """Exponential backoff with full jitter."""
+    return random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt))
+
+
+def call(provider: str, fn: Callable[[], Any], tokens: float = 0,
+         used_tokens: Optional[Callable[[Any], Optional[float]]] = None, attempts: int = RETRY_ATTEMPTS):
+    """Calls a provider API within its quotas, retrying rate-limit, server and connection errors.
+
+    `tokens` is the estimated cost of the call in the provider's token quota; once the
+    call returns, `used_tokens(result)` may give the real cost so the bucket is corrected.
+    Errors that aren't retryable, or persist after `attempts` tries, are raised.
+    """
+    buckets = BUCKETS.get(provider, {})
+    for attempt in range(attempts):
+        taken = {}  # unit -> tokens taken for this attempt, handed back if it never runs
+        try:
+            if "requests" in buckets:
+                buckets["requests"].acquire(1)
+                taken["requests"] = 1
+            if tokens and "tokens" in buckets:
+                buckets["tokens"].acquire(tokens)
+                taken["tokens"] = tokens
+            if deadlines.expired():
+                raise TimeoutError(f"run deadline passed while waiting for {provider} quota")
+        except TimeoutError:
+            for unit, amount in taken.items():
+                buckets[unit].adjust(-amount)
+            raise
+        try:
+            result = fn()
+        except Exception as e:
+            if attempt == attempts - 1 or not is_retryable(e):
+                raise
+            code = status_code(e)
+            delay = retry_after(e) or backoff_delay(attempt)
+            left = deadlines.remaining()
+            if left is not None and delay >= left:
+                raise  # Retrying would finish after the run's deadline
+            if code == 429:
+                for bucket in buckets.values():
+                    bucket.pause(delay)  # Every caller backs off, not just this one
+            metrics.inc("research_retries_total", provider=provider, reason=str(code or type(e).__name__))
+            time.sleep(delay)
+            continue
+        if used_tokens is not None and "tokens" in buckets:
+            used = used_tokens(result)
+            if used:
+                buckets["tokens"].adjust(used - tokens)
+        return result
@@ -0,0 +1,278 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, Optional, Tuple
+
+try:
+    import orjson  # Optional, several times faster than json for large results
+except ImportError:
+    orjson = None
+
+from cache import hash_key
+from jobs import job_key
+
+# Result store settings, overridable through the environment
+RESULT_STORE_PATH = os.getenv("RESULT_STORE_PATH", "research.db")
+ENTITY_ALIASES_FILE = os.getenv("ENTITY_ALIASES_FILE")  # JSON object of alias -> company name, e.g. {"Alphabet": "Google"}
+
+# How long each domain's results stay valid, in seconds. Override one with e.g. FRESHNESS_FINANCE=3600
+DAY = 24 * 60 * 60
+DEFAULT_FRESHNESS = {
+    "finance": 1 * DAY,
+    "markets": 7 * DAY,
+    "audience": 30 * DAY,
+    "paralegal": 7 * DAY,
+    "political": 14 * DAY,
+    "general": 30 * DAY,
+    "competitors": 14 * DAY,
+    "profile": 14 * DAY,  # Company profiles reused as competitor entries, see EntityStore
+}
+FRESHNESS = {
+    domain: float(os.getenv(f"FRESHNESS_{domain.upper()}", max_age))
+    for domain, max_age in DEFAULT_FRESHNESS.items()
+}
+
+
+def dumps_json(data) -> bytes:
+    """Serializes results to compact JSON bytes, using orjson when it is installed."""
+    if orjson is not None:
+        return orjson.dumps(data, default=str, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(data, default=str, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+
+def source_fingerprint(urls) -> str:
+    """Returns a fingerprint of a set of source URLs, independent of their order."""
+    return hash_key("sources", *sorted(set(urls)))
+
+
+class DomainResultStore:
+    """Per-company, per-domain research results with timestamps and source fingerprints.
+
+    Backed by SQLite so every worker process sees the same results.
+    """
+
+    def __init__(self, path: str = RESULT_STORE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                """CREATE TABLE IF NOT EXISTS domain_results (
+                    company_key TEXT NOT NULL,
+                    domain TEXT NOT NULL,
+                    data TEXT NOT NULL,
+                    source_fingerprint TEXT,
+                    updated_at REAL NOT NULL,
+                    PRIMARY KEY (company_key, domain)
+                )"""
+            )
+
+    def load(self, company_name: str) -> Dict[str, dict]:
+        """Returns {domain: {"data", "source_fingerprint", "updated_at"}} for a company."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT domain, data, source_fingerprint, updated_at FROM domain_results WHERE company_key = ?",
+                (job_key(company_name),),
+            ).fetchall()
+        return {
+            domain: {"data": json.loads(data), "source_fingerprint": fingerprint, "updated_at": updated_at}
+            for domain, data, fingerprint, updated_at in rows
+        }
+
+    def save(self, company_name: str, domain: str, data, fingerprint: Optional[str] = None):
+        try:
+            with self._lock, self._conn:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO domain_results VALUES (?, ?, ?, ?, ?)",
+                    (job_key(company_name), domain, json.dumps(data, default=str), fingerprint, time.time()),
+                )
+        except sqlite3.Error as e:
+            print(f"Error saving {domain} results for {company_name}: {e}")
+
+    def fresh_results(self, company_name: str, fingerprints: Dict[str, str]) -> Dict[str, dict]:
+        """Returns the stored results that are still valid for the given source fingerprints.
+
+        A domain is reused when it is younger than its freshness policy and its sources
+        have not changed since it was researched.
+        """
+        now = time.time()
+        fresh = {}
+        for domain, entry in self.load(company_name).items():
+            max_age = FRESHNESS.get(domain, 0)
+            if now - entry["updated_at"] > max_age:
+                continue
+            if fingerprints.get(domain) != entry["source_fingerprint"]:
+                continue
+            fresh[domain] = entry["data"]
+        return fresh
+
+
+class ResearchResultStore:
+    """Full research results per run, indexed by company and time.
+
+    Results are stored as the exact JSON bytes served to clients, along with their
+    ETag, so reads never re-serialize.
+    """
+
+    def __init__(self, path: str = RESULT_STORE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                """CREATE TABLE IF NOT EXISTS research_results (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    company_key TEXT NOT NULL,
+                    company_name TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    etag TEXT NOT NULL,
+                    data BLOB NOT NULL
+                )"""
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_research_results_company ON research_results (company_key, created_at)"
+            )
+
+    @staticmethod
+    def serialize(data) -> Tuple[bytes, str]:
+        """Returns the JSON body for the results and its ETag."""
+        body = dumps_json(data)
+        return body, hashlib.sha256(body).hexdigest()[:32]
+
+    def save(self, company_name: str, data, body: Optional[bytes] = None, etag: Optional[str] = None) -> str:
+        """Stores a run's results and returns their ETag."""
+        if body is None:
+            body, etag = self.serialize(data)
+        try:
+            with self._lock, self._conn:
+                self._conn.execute(
+                    "INSERT INTO research_results (company_key, company_name, created_at, etag, data) VALUES (?, ?, ?, ?, ?)",
+                    (job_key(company_name), company_name, time.time(), etag, body),
+                )
+        except sqlite3.Error as e:
+            print(f"Error saving results for {company_name}: {e}")
+        return etag
+
+    def latest(self, company_name: str) -> Optional[dict]:
+        """Returns the most recent run for a company as {"body", "etag", "created_at"}."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT data, etag, created_at FROM research_results WHERE company_key = ? ORDER BY created_at DESC LIMIT 1",
+                (job_key(company_name),),
+            ).fetchone()
+        if row is None:
+            return None
+        body, etag, created_at = row
+        return {"body": bytes(body), "etag": etag, "created_at": created_at}
+
+
+# Legal-form suffixes ignored when matching company names, so "Acme Inc." and "ACME" are one entity
+LEGAL_SUFFIXES = {
+    "inc", "incorporated", "corp", "corporation", "co", "company", "ltd", "limited", "llc", "plc", "lp", "llp",
+    "sa", "ag", "gmbh", "nv", "bv", "se", "spa", "ab", "oy", "as", "pty", "holdings", "group",
+}
+
+
+def entity_key(company_name: str) -> str:
+    """Normalizes a company name for entity matching: case, punctuation and legal suffixes are ignored."""
+    words = re.sub(r"[^\w\s]", " ", company_name.lower().replace("&", " and ")).split()
+    while len(words) > 1 and words[-1] in LEGAL_SUFFIXES:
+        words.pop()
+    return " ".join(words)
+
+
+def profile_from_results(company_name: str, results: dict) -> Optional[dict]:
+    """Builds a competitor-shaped profile (company_name, summary, key_metrics) from a company's research results."""
+    if not results or not results.get("exists"):
+        return None
+    general = results.get("general") or {}
+    finance = results.get("finance") or {}
+    summary = general.get("summary") or finance.get("summary")
+    if not summary:
+        return None
+    return {"company_name": company_name, "summary": summary, "key_metrics": finance.get("key_metrics") or {}}
+
+
+class EntityStore:
+    """Company profiles shared across runs, looked up by normalized name or alias.
+
+    Every researched company leaves a short profile here, so later runs can fill in
+    competitor entries from it instead of relying on a few retrieved chunks.
+    """
+
+    def __init__(self, path: str = RESULT_STORE_PATH, aliases_file: Optional[str] = ENTITY_ALIASES_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                """CREATE TABLE IF NOT EXISTS entities (
+                    entity_key TEXT PRIMARY KEY,
+                    company_name TEXT NOT NULL,
+                    profile TEXT NOT NULL,
+                    updated_at REAL NOT NULL
+                )"""
+            )
+            self._conn.execute(
+                """CREATE TABLE IF NOT EXISTS entity_aliases (
+                    alias_key TEXT PRIMARY KEY,
+                    entity_key TEXT NOT NULL
+                )"""
+            )
+        if aliases_file:
+            with open(aliases_file, encoding="utf-8") as infile:
+                for alias, company_name in json.load(infile).items():
+                    self.add_alias(alias, company_name)
+
+    def resolve(self, company_name: str) -> str:
+        """Returns the entity key a company name refers to, following aliases."""
+        key = entity_key(company_name)
+        with self._lock:
+            row = self._conn.execute("SELECT entity_key FROM entity_aliases WHERE alias_key = ?", (key,)).fetchone()
+        return row[0] if row else key
+
+    def add_alias(self, alias: str, company_name: str):
+        """Makes `alias` refer to the same entity as `company_name`."""
+        alias_key, key = entity_key(alias), self.resolve(company_name)
+        if alias_key == key:
+            return
+        try:
+            with self._lock, self._conn:
+                self._conn.execute("INSERT OR REPLACE INTO entity_aliases VALUES (?, ?)", (alias_key, key))
+        except sqlite3.Error as e:
+            print(f"Error saving alias {alias} for {company_name}: {e}")
+
+    def save_profile(self, company_name: str, profile: dict, aliases: Iterable[str] = ()):
+        key = self.resolve(company_name)
+        try:
+            with self._lock, self._conn:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO entities VALUES (?, ?, ?, ?)",
+                    (key, company_name, json.dumps(profile, default=str), time.time()),
+                )
+        except sqlite3.Error as e:
+            print(f"Error saving profile for {company_name}: {e}")
+        for alias in aliases:
+            self.add_alias(alias, company_name)
+
+    def fresh_profiles(self, company_names: Iterable[str], max_age: float = FRESHNESS["profile"]) -> Dict[str, dict]:
+        """Returns {name: profile} for the names whose entity has a profile younger than `max_age`."""
+        keys = {name: self.resolve(name) for name in company_names}
+        if not keys:
+            return {}
+        unique_keys = list(set(keys.values()))
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT entity_key, profile FROM entities WHERE updated_at >= ? "
+                f"AND entity_key IN ({', '.join('?' * len(unique_keys))})",
+                (time.time() - max_age, *unique_keys),
+            ).fetchall()
+        profiles = {key: json.loads(profile) for key, profile in rows}
+        return {name: profiles[key] for name, key in keys.items() if key in profiles}
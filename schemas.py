@@ -46,6 +46,10 @@ class DomainInfo(BaseModel):
         return value  # For other cases, just return the value
 
 
+class DomainInfoMap(BaseModel):
+    domains: Dict[str, DomainInfo] = Field(description="Information for each requested domain, keyed by domain name")
+
+
 class CompanyResearch(BaseModel):
     company_name: str = Field(description="Name of the company")
     exists: bool = Field(description="Whether the company exists")
@@ -0,0 +1,100 @@
+import json
+import os
+from typing import Dict, List, Optional
+
+from cache import LRUCache, SingleFlight, hash_key, open_store
+import metrics
+import ratelimit
+
+# Search cache settings, overridable through the environment
+SEARCH_BACKEND = os.getenv("SEARCH_BACKEND", "tavily")  # "tavily" or "stub"
+SEARCH_STUB_FILE = os.getenv("SEARCH_STUB_FILE")  # JSON file of canned results for the stub backend
+SEARCH_CACHE_TTL = float(os.getenv("SEARCH_CACHE_TTL", "21600"))
+SEARCH_CACHE_SIZE = int(os.getenv("SEARCH_CACHE_SIZE", "1024"))
+SEARCH_CACHE_STORE = os.getenv("SEARCH_CACHE_STORE", "memory")  # "memory", "disk" or "sqlite"
+SEARCH_CACHE_PATH = os.getenv("SEARCH_CACHE_PATH")
+
+
+class TavilyBackend:
+    """Runs searches against the Tavily API."""
+
+    def __init__(self, client):
+        self.client = client
+
+    def search(self, query: str, search_depth: str) -> List[dict]:
+        results = self.client.search(query=query, search_depth=search_depth)
+        # Adjust based on actual API response structure
+        return results.get('results', []) if isinstance(results, dict) else []
+
+
+class StubSearchBackend:
+    """Returns canned results so the pipeline can run offline.
+
+    `results` maps a query to its result list; the "*" entry, if present, is
+    returned for any query that isn't listed.
+    """
+
+    def __init__(self, results: Optional[Dict[str, List[dict]]] = None):
+        self.results = results or {}
+        self.calls = 0
+
+    @classmethod
+    def from_file(cls, path: str) -> "StubSearchBackend":
+        with open(path, encoding="utf-8") as infile:
+            return cls(json.load(infile))
+
+    def search(self, query: str, search_depth: str) -> List[dict]:
+        self.calls += 1
+        return self.results.get(query, self.results.get("*", []))
+
+
+class CachedSearch:
+    """Caches search results by (query, search_depth) and coalesces identical in-flight searches.
+
+    Results live in a TTL-bounded LRU in memory and, optionally, in a persistent store
+    (see cache.open_store) shared by every worker process.
+    """
+
+    def __init__(self, backend, ttl: float = SEARCH_CACHE_TTL, cache_size: int = SEARCH_CACHE_SIZE, store=None):
+        self.backend = backend
+        self.store = store
+        self._memory = LRUCache(cache_size, ttl=ttl)
+        self._inflight = SingleFlight()
+
+    @staticmethod
+    def cache_key(query: str, search_depth: str) -> str:
+        return hash_key("search", " ".join(query.lower().split()), search_depth)
+
+    def _search(self, key: str, query: str, search_depth: str) -> List[dict]:
+        if self.store is not None:
+            results = self.store.get(key)
+            if results is not None:
+                metrics.record_cache("search", hit=True)
+                self._memory.set(key, results)
+                return results
+        metrics.record_cache("search", hit=False)
+        # Only real backend calls count against the Tavily quota; cache hits are free
+        results = ratelimit.call("tavily", lambda: self.backend.search(query, search_depth))
+        self._memory.set(key, results)
+        if self.store is not None:
+            self.store.set(key, results)
+        return results
+
+    def search(self, query: str, search_depth: str = "advanced") -> List[dict]:
+        key = self.cache_key(query, search_depth)
+        results = self._memory.get(key)
+        if results is not None:
+            metrics.record_cache("search", hit=True)
+            return results
+        return self._inflight.do(key, lambda: self._search(key, query, search_depth))
+
+
+def create_search(api_key: Optional[str] = None) -> CachedSearch:
+    """Builds the cached search client configured by the SEARCH_* environment variables."""
+    if SEARCH_BACKEND == "stub":
+        backend = StubSearchBackend.from_file(SEARCH_STUB_FILE) if SEARCH_STUB_FILE else StubSearchBackend()
+    else:
+        from tavily import TavilyClient
+        backend = TavilyBackend(TavilyClient(api_key=api_key))
+    store = open_store(SEARCH_CACHE_STORE, SEARCH_CACHE_PATH, ttl=SEARCH_CACHE_TTL, table="search")
+    return CachedSearch(backend, store=store)
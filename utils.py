@@ -1,92 +1,362 @@
 import os
 from dotenv import load_dotenv
-from langchain_groq import ChatGroq
-from tavily import TavilyClient
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain.prompts import PromptTemplate
-from langchain.output_parsers import PydanticOutputParser
-from typing import List
-from schemas import DomainInfo, Competitor, CompetitorList  # Ensure this import is at the top to avoid circular dependencies
-
-# Updated imports to address deprecation warnings
-from langchain_community.document_loaders import UnstructuredURLLoader, UnstructuredPDFLoader
-from langchain_community.embeddings import FastEmbedEmbeddings
-
-# Initialize in the global scope to avoid re-initializing in multiple functions
+
+# Load .env before the local modules below read their settings from the environment
 load_dotenv()
 
+from io import BytesIO
+import threading
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+from typing import TYPE_CHECKING, Dict, List, Optional
+from search_cache import create_search, SEARCH_BACKEND
+from llm_cache import create_extraction_cache
+from extraction import charset_param, detect_encoding, sniff_content_type, extract_html_text, extract_pdf_text, extract_text
+import deadlines
+import metrics
+import ratelimit
+
+if TYPE_CHECKING:
+    from ingest import Chunk
+
+# API keys, read once; they are checked when the clients that need them are first created
 tavily_api_key = os.getenv("TAVILY_API_KEY")
 groq_api_key = os.getenv("GROQ_API_KEY")
 
-if not tavily_api_key or not groq_api_key:
-    raise ValueError("TAVILY_API_KEY and GROQ_API_KEY must be set in the .env file")
+# "groq", or "fake" for the deterministic offline model in fakes.py
+LLM_BACKEND = os.getenv("LLM_BACKEND", "groq")
+LLM_MODEL = "fake-research" if LLM_BACKEND == "fake" else os.getenv("GROQ_MODEL", "mixtral-8x7b-32768")  # Or any other supported Groq model
+
+# "per_domain" extracts each domain with its own LLM call; "combined" extracts every domain's
+# information in one call, falling back to per-domain calls for domains it doesn't return valid
+EXTRACTION_MODE = os.getenv("EXTRACTION_MODE", "per_domain")
+
+# Clients and heavy dependencies are created on first use (or by main.warmup), so importing
+# this module stays cheap for every Flask worker and CLI process
+_tavily = None
+_llm = None
+_extraction_cache = None
+_extraction_prompts = None
+_fetcher = None
+_init_lock = threading.Lock()
+
+
+def check_api_keys():
+    """Raises if a backend that calls out to a real API is selected without its key."""
+    if (SEARCH_BACKEND != "stub" and not tavily_api_key) or (LLM_BACKEND != "fake" and not groq_api_key):
+        raise ValueError("TAVILY_API_KEY and GROQ_API_KEY must be set in the .env file")
+
+
+def get_search():
+    """Returns the shared Tavily client (behind the search cache), creating it on first use."""
+    global _tavily
+    if _tavily is None:
+        with _init_lock:
+            if _tavily is None:
+                check_api_keys()
+                _tavily = create_search(api_key=tavily_api_key)
+    return _tavily
+
+
+def get_llm():
+    """Returns the shared Groq chat model, creating it on first use."""
+    global _llm
+    if _llm is None:
+        with _init_lock:
+            if _llm is None:
+                check_api_keys()
+                if LLM_BACKEND == "fake":
+                    from fakes import FakeResearchLLM
+                    _llm = FakeResearchLLM(latency=float(os.getenv("FAKE_LLM_LATENCY", "0")))
+                else:
+                    from langchain_groq import ChatGroq
+                    # Retries are left to ratelimit.call, which backs off across every caller
+                    _llm = ChatGroq(temperature=0, groq_api_key=groq_api_key, model_name=LLM_MODEL, max_retries=0,
+                                    timeout=deadlines.STAGE_TIMEOUTS["llm"] or None)
+    return _llm
+
+
+def get_extraction_cache():
+    """Returns the cache of parsed extraction outputs, keyed by model name and rendered prompt."""
+    global _extraction_cache
+    if _extraction_cache is None:
+        with _init_lock:
+            if _extraction_cache is None:
+                _extraction_cache = create_extraction_cache(LLM_MODEL)
+    return _extraction_cache
+
+
+DOMAIN_TEMPLATE = """You are a research assistant tasked with extracting information about {company_name} in the {domain} domain.
+You should use the following context to extract the information. If the information isn't available respond with 'NA'. 
+Each passage starts with its [Source: URL]; list the URLs of the passages you used in news_links.
+
+{context}
+
+You must respond in a JSON format that adheres to the following schema:
+{format_instructions}
+"""
+
+DOMAINS_TEMPLATE = """You are a research assistant tasked with extracting information about {company_name} in these domains: {domains}.
+Each domain's context follows its heading; use only that context for the domain. If the information isn't available respond with 'NA'.
+Each passage starts with its [Source: URL]; list the URLs of the passages you used in that domain's news_links.
+
+{contexts}
+
+You must respond in a JSON format that adheres to the following schema, with one entry under "domains" for each domain above, keyed by its name:
+{format_instructions}
+"""
+
+COMPETITORS_TEMPLATE = """You are a research assistant tasked with extracting information about competitors of {company_name}.
+You should use the following context to extract the information. If a competitor isn't mentioned or information isn't available, respond with 'NA'.
+
+{context}
+
+You must respond in a JSON format that adheres to the following schema:
+{format_instructions}
+"""
+
+
+def get_extraction_prompts() -> dict:
+    """Returns the extraction prompts and output parsers, building them on first use.
+
+    Maps "domain", "domains" (combined mode) and "competitors" to a (PromptTemplate, parser)
+    pair whose schema format instructions are already filled in.
+    """
+    global _extraction_prompts
+    if _extraction_prompts is None:
+        with _init_lock:
+            if _extraction_prompts is None:
+                from langchain.prompts import PromptTemplate
+                from langchain.output_parsers import PydanticOutputParser
+                from langchain_core.output_parsers import JsonOutputParser
+                from schemas import CompetitorList, DomainInfo, DomainInfoMap
+
+                prompts = {}
+                for kind, template, schema in (
+                    ("domain", DOMAIN_TEMPLATE, DomainInfo),
+                    ("domains", DOMAINS_TEMPLATE, DomainInfoMap),
+                    ("competitors", COMPETITORS_TEMPLATE, CompetitorList),
+                ):
+                    parser = PydanticOutputParser(pydantic_object=schema)
+                    prompt = PromptTemplate.from_template(template).partial(
+                        format_instructions=parser.get_format_instructions()
+                    )
+                    prompts[kind] = (prompt, parser)
+                # Combined replies are parsed as plain JSON, so each domain can be validated on its own
+                prompts["domains"] = (prompts["domains"][0], JsonOutputParser())
+                _extraction_prompts = prompts
+    return _extraction_prompts
+
+
+def get_fetcher():
+    """Returns the fetcher shared across every node and request, so downloads and parsed pages are reused."""
+    global _fetcher
+    if _fetcher is None:
+        with _init_lock:
+            if _fetcher is None:
+                from fetcher import DocumentFetcher
+                _fetcher = DocumentFetcher()
+    return _fetcher
+
+
+def get_embeddings():
+    """Returns the shared cached embeddings (see embedding_cache.get_embeddings)."""
+    from embedding_cache import get_embeddings as get_cached_embeddings
+    return get_cached_embeddings()
 
-# Initialize Tavily and Groq
-tavily = TavilyClient(api_key=tavily_api_key)
-llm = ChatGroq(temperature=0, groq_api_key=groq_api_key, model_name="mixtral-8x7b-32768")  # Or any other supported Groq model
 
 # Constants
 CHUNK_SIZE = 500
 CHUNK_OVERLAP = 50
 
+# Context packing settings, overridable through the environment
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "500"))  # Prompt tokens of context per domain (k=3 was ~375)
+MMR_LAMBDA = float(os.getenv("MMR_LAMBDA", "0.7"))  # 1 ranks by relevance only, 0 by diversity only
+MMR_FETCH_K = int(os.getenv("MMR_FETCH_K", "20"))  # Most relevant chunks considered per query
+
 
 def tavily_search(query: str, search_depth="advanced"):
-    """Searches Tavily for the given query."""
+    """Searches Tavily for the given query, reusing cached results when they are fresh."""
     try:
-        results = tavily.search(query=query, search_depth=search_depth)
-        # Adjust based on actual API response structure
-        return results.get('results', []) if isinstance(results, dict) else []
+        with metrics.span("search", query=query):
+            return deadlines.run_with_timeout("search", get_search().search, query, search_depth=search_depth)
+    except TimeoutError:
+        raise  # Not the same as finding nothing; the caller reports it as timed out
     except Exception as e:
+        metrics.record_error("search")
         print(f"Tavily Search Error: {e}")
         return []
 
 
-def load_and_chunk_data(url: str, chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP):
-    """Loads data from a URL and chunks it for LLM processing."""
-    try:
-        if url.endswith('.pdf'):
-            loader = UnstructuredPDFLoader(url)
-        else:
-            loader = UnstructuredURLLoader(urls=[url])
-        data = loader.load()
-        text_splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
-        all_splits = text_splitter.split_documents(data)
-        return all_splits
-    except Exception as e:
-        print(f"Error loading and chunking data from {url}: {e}")
-        return []
+def partition_with_unstructured(kind: str, content: bytes, encoding: Optional[str] = None) -> str:
+    """Extracts text with Unstructured, which is slow but copes with scanned PDFs and unusual layouts."""
+    # Imported here because unstructured is slow to import
+    if kind == "pdf":
+        from unstructured.partition.pdf import partition_pdf
+        elements = partition_pdf(file=BytesIO(content))
+    else:
+        from unstructured.partition.html import partition_html
+        elements = partition_html(text=content.decode(detect_encoding(content, encoding, html=True), errors="replace"))
+    return "\n\n".join(str(element) for element in elements)
 
 
-def create_vectorstore(chunks: List[str], embeddings: FastEmbedEmbeddings):
-    """Creates a vectorstore from the given chunks."""
-    try:
-        if not chunks:
-            print("No chunks to create vectorstore.")
-            return None
-        
-        # Import here to ensure it's loaded after installation
-        from langchain_community.vectorstores import Chroma
-        db = Chroma.from_documents(chunks, embeddings)
-        return db
-    except ImportError:
-        print("Error: Please ensure chromadb is installed correctly")
+# Query parameters that only track where a click came from
+TRACKING_PARAMS = {"gclid", "fbclid", "mc_cid", "mc_eid", "ref", "cmpid"}
+
+
+def canonical_url(url: str) -> str:
+    """Returns a key under which different spellings of the same page compare equal."""
+    parts = urlsplit(url.strip())
+    scheme = "https" if parts.scheme.lower() in ("http", "https") else parts.scheme.lower()
+    host = parts.netloc.lower().removeprefix("www.")
+    path = parts.path.rstrip("/") or "/"
+    query = sorted(
+        (key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+        if not key.lower().startswith("utm_") and key.lower() not in TRACKING_PARAMS
+    )
+    return urlunsplit((scheme, host, path, urlencode(query), ""))
+
+
+def unique_urls(urls: List[str]) -> List[str]:
+    """Drops repeated URLs, keeping the first spelling of each page in order."""
+    seen = {}
+    for url in urls:
+        seen.setdefault(canonical_url(url), url)
+    return list(seen.values())
+
+
+def parse_page(url: str, content: bytes, content_type: str = "") -> Optional[str]:
+    """Extracts the text of a downloaded page or PDF, or returns None if it can't be parsed.
+
+    The parser is picked from the body's magic bytes and Content-Type. HTML and PDFs go
+    through the fast lxml and pypdf extractors; Unstructured is only used for documents
+    they get too little text from, such as scanned PDFs or script-heavy pages. Text is
+    decoded in the Content-Type charset when the header gives one.
+    """
+    kind = sniff_content_type(url, content, content_type)
+    encoding = charset_param(content_type)
+    if kind == "other":
+        print(f"Skipping {url}: unsupported content type {content_type or 'unknown'}")
         return None
+
+    with metrics.span("parse", url=url, kind=kind):
+        if kind == "pdf":
+            parser, text = "pypdf", extract_pdf_text(content)
+        elif kind == "html":
+            parser, text = "lxml", extract_html_text(content, encoding=encoding)
+        else:
+            parser, text = "text", extract_text(content, encoding)
+        if text is None:
+            try:
+                parser, text = "unstructured", partition_with_unstructured(kind, content, encoding)
+            except ImportError:
+                if kind != "html":
+                    raise
+                parser, text = "lxml", extract_html_text(content, min_chars=0, encoding=encoding) or ""
+    metrics.inc("research_pages_parsed_total", kind=kind, parser=parser)
+    return text
+
+
+def page_chunker(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP):
+    """Returns the fetcher parse function that turns a downloaded page into Chunk records."""
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+    from ingest import Chunk
+    text_splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+
+    def parse_and_chunk(url: str, content: bytes, content_type: str) -> List["Chunk"]:
+        text = parse_page(url, content, content_type)
+        # Only the chunks outlive this call; the body and the page's full text are released here
+        chunks = [Chunk(piece, url) for piece in text_splitter.split_text(text)] if text else []
+        metrics.inc("research_chunks_produced_total", len(chunks))
+        return chunks
+
+    return parse_and_chunk
+
+
+def load_and_index_urls(urls: List[str], queries: Dict[str, str], embeddings, keep: int = MMR_FETCH_K,
+                        chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP):
+    """Fetches, chunks, dedupes and embeds the URLs as a stream into an index of candidates for `queries`.
+
+    A run never holds every chunk and vector at once: pages are chunked as they arrive,
+    embedded in batches, and only each query's `keep` best chunks are kept (see
+    ingest.ingest), within the run's INGEST_MEMORY_LIMIT_MB. Returns None if nothing
+    could be indexed.
+    """
+    from ingest import ingest
+    pages = get_fetcher().iter_many(urls, page_chunker(chunk_size, chunk_overlap), variant=f"{chunk_size}:{chunk_overlap}")
+    try:
+        return ingest((chunks for _, chunks in pages), embeddings, list(queries.values()), keep)
     except Exception as e:
-        print(f"Error creating vectorstore: {e}")
+        metrics.record_error("index_build")
+        print(f"Error indexing pages: {e}")
         return None
 
 
-def retrieve_context(db, query, k=3):
-    """Retrieves context from the vectorstore based on the query."""
+def estimate_tokens(text: str) -> int:
+    """Rough token count (about four characters per token), good enough for budgeting prompts."""
+    return len(text) // 4 + 1
+
+
+def format_context_block(doc) -> str:
+    source = doc.metadata.get("source")
+    return f"[Source: {source}]\n{doc.page_content}" if source else doc.page_content
+
+
+def pack_contexts(db, queries: Dict[str, str], token_budget: int = CONTEXT_TOKEN_BUDGET,
+                  lambda_mult: float = MMR_LAMBDA, fetch_k: int = MMR_FETCH_K) -> Dict[str, dict]:
+    """Builds each named query's context from the index, up to `token_budget` tokens.
+
+    Chunks are picked by maximal marginal relevance, so near-identical passages don't
+    crowd out the rest, and each is labelled with its source URL. Returns
+    {name: {"context": text, "sources": [url, ...]}}, sources in relevance order.
+    """
     try:
         if not db:
             print("Vectorstore is None. Cannot retrieve context.")
-            return ""
-        docs = db.similarity_search(query, k=k)
-        return "\n".join([doc.page_content for doc in docs])
+            return {}
+        names = list(queries)
+        with metrics.span("retrieve", queries=len(names)):
+            hits = db.mmr_search_by_vectors(
+                db.embed_queries([queries[name] for name in names]),
+                budget=token_budget,
+                cost=lambda doc: estimate_tokens(format_context_block(doc)),
+                fetch_k=fetch_k,
+                lambda_mult=lambda_mult,
+            )
+        packed = {}
+        for name, picked in zip(names, hits):
+            docs = [doc for doc, _ in picked]
+            sources = list(dict.fromkeys(doc.metadata["source"] for doc in docs if doc.metadata.get("source")))
+            packed[name] = {"context": "\n\n".join(format_context_block(doc) for doc in docs), "sources": sources}
+        return packed
     except Exception as e:
+        metrics.record_error("retrieve")
         print(f"Error retrieving context: {e}")
-        return ""
+        return {}
+
+
+def call_llm(prompt: str):
+    """Sends a prompt to the LLM within the Groq request and token quotas, retrying rate limits.
+
+    Raises TimeoutError if the call, including waiting for quota, outlasts the "llm" stage timeout.
+    """
+    return deadlines.run_with_timeout(
+        "llm",
+        ratelimit.call,
+        "groq",
+        lambda: get_llm().invoke(prompt),
+        tokens=estimate_tokens(prompt) + ratelimit.GROQ_COMPLETION_TOKENS,
+        used_tokens=lambda message: (getattr(message, "usage_metadata", None) or {}).get("total_tokens"),
+    )
+
+
+def invoke_llm(prompt: str, parser, name: str):
+    """Sends a rendered prompt to the LLM, records its latency and token usage, and parses the reply."""
+    with metrics.span("llm", name=name):
+        message = call_llm(prompt)
+    usage = getattr(message, "usage_metadata", None) or {}
+    metrics.inc("research_llm_tokens_total", usage.get("input_tokens", 0), direction="sent")
+    metrics.inc("research_llm_tokens_total", usage.get("output_tokens", 0), direction="received")
+    return parser.invoke(message)
 
 
 def create_domain_summary(company_name: str, domain: str, context: str):
@@ -100,71 +370,88 @@ Include news_links in your summary if available.
 Return your answer in markdown format:"""
 
     try:
-        response = llm.invoke(prompt)
+        response = call_llm(prompt)
         return response.content
     except Exception as e:
         print(f"Error creating domain summary for {domain}: {e}")
         return ""
 
 
-def extract_domain_info(company_name: str, domain: str, context: str):
-    """Extracts structured information for a specific domain using the LLM."""
-    parser = PydanticOutputParser(pydantic_object=DomainInfo)
+def sanitize_domain_info(output: dict) -> dict:
+    """Turns the 'NA' placeholders the LLM uses for missing information into None or empty lists."""
+    for key, value in output.get("key_metrics", {}).items():
+        if value == "NA":
+            output["key_metrics"][key] = None
 
-    prompt = PromptTemplate(
-        template="""You are a research assistant tasked with extracting information about {company_name} in the {domain} domain.
-You should use the following context to extract the information. If the information isn't available respond with 'NA'. 
+    list_fields = ["market_trends", "competitors", "legal_issues", "news_links"]
+    for field in list_fields:
+        if field in output and output[field] == "NA":
+            output[field] = []
+    return output
 
-{context}
 
-You must respond in a JSON format that adheres to the following schema:
-{format_instructions}
-""",
-        input_variables=["company_name", "domain", "context"],
-        partial_variables={"format_instructions": parser.get_format_instructions()}
-    )
+def extract_domain_info(company_name: str, domain: str, context: str):
+    """Extracts structured information for a specific domain using the LLM."""
+    prompt, parser = get_extraction_prompts()["domain"]
 
     try:
-        chain = prompt | llm | parser
-        raw_output = chain.invoke({"company_name": company_name, "domain": domain, "context": context})
-        output = raw_output.dict(exclude_none=True)
+        rendered = prompt.format(company_name=company_name, domain=domain, context=context)
+        raw_output = get_extraction_cache().get_or_compute(rendered, lambda: invoke_llm(rendered, parser, domain))
+        return sanitize_domain_info(raw_output.dict(exclude_none=True))
+    except TimeoutError:
+        raise  # The research node reports the domain as timed out
+    except Exception as e:
+        metrics.record_error("llm")
+        print(f"Error extracting {domain} information: {e}")
+        return {}
 
-        # Sanitize the output to handle "NA" values for lists
-        for key, value in output.get("key_metrics", {}).items():
-            if value == "NA":
-                output["key_metrics"][key] = None
 
-        list_fields = ["market_trends", "competitors", "legal_issues", "news_links"]
-        for field in list_fields:
-            if field in output and output[field] == "NA":
-                output[field] = []
+def extract_domains_info(company_name: str, contexts: Dict[str, str]) -> Dict[str, dict]:
+    """Extracts structured information for several domains with a single LLM call.
 
-        return output
+    The schema instructions are sent once instead of once per domain. Each domain's
+    entry in the reply is validated on its own; the returned map only holds the domains
+    that validated, so the caller can fall back to extract_domain_info for the rest.
+    """
+    from schemas import DomainInfo
+
+    prompt, parser = get_extraction_prompts()["domains"]
+    names = list(contexts)
+    rendered = prompt.format(
+        company_name=company_name,
+        domains=", ".join(names),
+        contexts="\n\n".join(f"### {name}\n{contexts[name]}" for name in names),
+    )
+    try:
+        raw_output = get_extraction_cache().get_or_compute(rendered, lambda: invoke_llm(rendered, parser, "domains"))
+    except TimeoutError:
+        raise  # The research node reports the domains as timed out
     except Exception as e:
-        print(f"Error extracting {domain} information: {e}")
+        metrics.record_error("llm")
+        print(f"Error extracting combined domain information: {e}")
         return {}
 
+    entries = raw_output.get("domains") if isinstance(raw_output, dict) else None
+    extracted = {}
+    for name in names:
+        entry = entries.get(name) if isinstance(entries, dict) else None
+        if entry is None:
+            print(f"Combined extraction returned no {name} information")
+            continue
+        try:
+            extracted[name] = sanitize_domain_info(DomainInfo.parse_obj(entry).dict(exclude_none=True))
+        except Exception as e:
+            print(f"Combined extraction returned invalid {name} information: {e}")
+    return extracted
+
 
 def extract_competitor_info(company_name: str, context: str):
     """Extracts structured information for competitors using the LLM."""
-    parser = PydanticOutputParser(pydantic_object=CompetitorList)
-
-    prompt = PromptTemplate(
-        template="""You are a research assistant tasked with extracting information about competitors of {company_name}.
-You should use the following context to extract the information. If a competitor isn't mentioned or information isn't available, respond with 'NA'.
-
-{context}
-
-You must respond in a JSON format that adheres to the following schema:
-{format_instructions}
-""",
-        input_variables=["company_name", "context"],
-        partial_variables={"format_instructions": parser.get_format_instructions()}
-    )
+    prompt, parser = get_extraction_prompts()["competitors"]
 
     try:
-        chain = prompt | llm | parser
-        raw_output = chain.invoke({"company_name": company_name, "context": context})
+        rendered = prompt.format(company_name=company_name, context=context)
+        raw_output = get_extraction_cache().get_or_compute(rendered, lambda: invoke_llm(rendered, parser, "competitors"))
         output = raw_output.dict(exclude_none=True)
 
         # Sanitize the output
@@ -175,6 +462,9 @@ You must respond in a JSON format that adheres to the following schema:
 
         return output.get("competitors", [])
 
+    except TimeoutError:
+        raise  # The research node reports the domain as timed out
     except Exception as e:
+        metrics.record_error("llm")
         print(f"Error extracting competitor information: {e}")
         return []
\ No newline at end of file
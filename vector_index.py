@@ -0,0 +1,129 @@
+from typing import Callable, List, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def embed_documents(embeddings, texts: List[str]) -> np.ndarray:
+    """Embeds texts as a float32 matrix, one row per text."""
+    if hasattr(embeddings, "embed_array"):
+        return embeddings.embed_array(texts)
+    return np.asarray(embeddings.embed_documents(texts), dtype=np.float32)
+
+
+def embed_queries(embeddings, queries: List[str]) -> np.ndarray:
+    if hasattr(embeddings, "embed_array"):
+        return embeddings.embed_array(queries, query=True)
+    return np.asarray([embeddings.embed_query(query) for query in queries], dtype=np.float32)
+
+
+class VectorIndex:
+    """In-memory cosine-similarity index over a contiguous float32 matrix.
+
+    Built once per run from the chunks a CandidatePool kept; several queries are
+    answered with a single matrix multiply followed by an MMR selection per row.
+    """
+
+    def __init__(self, documents: List[Document], vectors: np.ndarray, embeddings):
+        self.documents = documents
+        self.vectors = np.ascontiguousarray(_normalize(np.asarray(vectors, dtype=np.float32)))
+        self.embeddings = embeddings
+
+    def __len__(self) -> int:
+        return len(self.documents)
+
+    def embed_queries(self, queries: List[str]) -> np.ndarray:
+        return embed_queries(self.embeddings, queries)
+
+    def mmr_search_by_vectors(
+        self,
+        query_vectors: np.ndarray,
+        budget: float,
+        cost: Callable[[Document], float],
+        fetch_k: int = 20,
+        lambda_mult: float = 0.7,
+    ) -> List[List[Tuple[Document, float]]]:
+        """Picks documents for each query by maximal marginal relevance until their total cost reaches `budget`.
+
+        Candidates are the `fetch_k` most similar documents. Each step takes the candidate
+        that best balances similarity to the query against similarity to the documents
+        already picked (`lambda_mult` 1 is pure relevance, 0 pure diversity); candidates
+        whose cost no longer fits the remaining budget are skipped. Documents come back
+        in the order they were picked, with their similarity to the query.
+        """
+        fetch_k = min(fetch_k, len(self.documents))
+        if fetch_k == 0:
+            return [[] for _ in range(len(query_vectors))]
+        scores = _normalize(np.asarray(query_vectors, dtype=np.float32)) @ self.vectors.T
+        top = np.argpartition(-scores, fetch_k - 1, axis=1)[:, :fetch_k]
+        costs = {}
+
+        results = []
+        for row, candidates in zip(scores, top):
+            relevance = row[candidates]
+            similarity = self.vectors[candidates] @ self.vectors[candidates].T
+            redundancy = np.zeros(len(candidates), dtype=np.float32)  # Max similarity to a picked document
+            available = np.ones(len(candidates), dtype=bool)
+            remaining = budget
+            picked = []
+            while available.any():
+                mmr = np.where(available, lambda_mult * relevance - (1 - lambda_mult) * redundancy, -np.inf)
+                best = int(np.argmax(mmr))
+                available[best] = False
+                index = int(candidates[best])
+                if index not in costs:
+                    costs[index] = cost(self.documents[index])
+                if costs[index] > remaining:
+                    continue
+                remaining -= costs[index]
+                picked.append((self.documents[index], float(relevance[best])))
+                redundancy = np.maximum(redundancy, similarity[best])
+            results.append(picked)
+        return results
+
+
+class CandidatePool:
+    """Keeps only the chunks that can still be retrieved for a fixed set of query vectors.
+
+    Chunks are added in embedded batches; after each batch, only the `keep` chunks most
+    similar to each query are kept, with their vectors, and the rest are dropped. An
+    index built from the pool answers top-k (k <= `keep`) and MMR searches over `keep`
+    candidates for those queries exactly as an index of every chunk would, while its
+    memory stays bounded by the number of queries times `keep`.
+    """
+
+    def __init__(self, query_vectors: np.ndarray, keep: int):
+        self.query_vectors = _normalize(np.asarray(query_vectors, dtype=np.float32))
+        self.keep = keep
+        self.documents: List[Document] = []
+        self.vectors = np.empty((0, self.query_vectors.shape[1]), dtype=np.float32)
+
+    def __len__(self) -> int:
+        return len(self.documents)
+
+    def add(self, documents: List[Document], vectors: np.ndarray):
+        if not documents:
+            return
+        documents = self.documents + list(documents)
+        vectors = np.concatenate([self.vectors, _normalize(np.asarray(vectors, dtype=np.float32))])
+        keep = min(self.keep, len(documents))
+        if keep and len(documents) > keep:
+            scores = self.query_vectors @ vectors.T
+            rows = np.unique(np.argpartition(-scores, keep - 1, axis=1)[:, :keep])
+            documents = [documents[i] for i in rows]
+            vectors = vectors[rows]
+        self.documents = documents
+        self.vectors = np.ascontiguousarray(vectors)
+
+    def nbytes(self) -> int:
+        """Rough memory held by the pool: chunk text and vectors."""
+        return self.vectors.nbytes + sum(len(doc.page_content) + 100 for doc in self.documents)
+
+    def to_index(self, embeddings) -> VectorIndex:
+        return VectorIndex(self.documents, self.vectors, embeddings)